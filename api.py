@@ -1,8 +1,66 @@
-import json,asyncio
+import json,asyncio,base64,time
+from contextvars import ContextVar
 from aiohttp import ClientSession
+import tracing
 
 api_url = 'http://127.0.0.1:3000'
 
+# 当前事件所属账号的 http 地址（多账号时由连接管理器设置，回复自动走收到事件的账号）
+current_api_url: ContextVar[str] = ContextVar('current_api_url', default=None)
+
+FORWARD_CHUNK_SIZE = 1500  # 合并转发时每个节点的最大字符数
+META_TTL = 600  # 群信息/成员缓存有效期（秒）
+META_MAX_ENTRIES = 5000  # 缓存条目上限，超过时先清理过期条目
+PREFETCH_CONCURRENCY = 4  # 批量预取成员列表的并发数
+
+def get_api_url() -> str:
+    '''
+    :return: 当前账号的 http 地址，未设置时回退到 api_url
+    '''
+    return current_api_url.get() or api_url
+
+async def _iter_lines(text):
+    '''
+    把 字符串/可迭代/异步可迭代 的文本统一转成逐行输出（保留换行符）
+    '''
+    async def pieces():
+        if isinstance(text, str):
+            yield text
+        elif hasattr(text, '__aiter__'):
+            async for piece in text:
+                yield piece
+        else:
+            for piece in text:
+                yield piece
+
+    pending = ''
+    async for piece in pieces():
+        pending += piece
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+async def chunk_text(text, chunk_size=FORWARD_CHUNK_SIZE):
+    '''
+    按行切分文本，每块不超过 chunk_size，单行过长时硬切
+    :param text: str|Iterable[str]|AsyncIterable[str]
+    :return: 异步迭代的文本块
+    '''
+    chunk = ''
+    async for line in _iter_lines(text):
+        while line:
+            part, line = line[:chunk_size], line[chunk_size:]
+            if chunk and len(chunk) + len(part) > chunk_size:
+                # 行长正好是 chunk_size 的整数倍时会剩下只有换行的块，不输出，避免空节点
+                if chunk.strip('\n'):
+                    yield chunk.strip('\n')
+                chunk = ''
+            chunk += part
+    if chunk.strip():
+        yield chunk.strip('\n')
+
 class Api:
     def __init__(self):
         self.message = []
@@ -15,10 +73,12 @@ class Api:
                 return data
 
     async def _post(self,**kwargs):
-        async with ClientSession() as fw:
-            async with fw.post(**kwargs) as resp:
-                data = await resp.json()
-                return data
+        # 追踪里按动作名记录（send_group_msg/get_group_info 等）
+        with tracing.span(f"api {kwargs.get('url','').rsplit('/',1)[-1]}"):
+            async with ClientSession() as fw:
+                async with fw.post(**kwargs) as resp:
+                    data = await resp.json()
+                    return data
 
     async def _add_text(self,text):
         text = {
@@ -69,6 +129,14 @@ class Api:
         }
         self.message.append(image)
 
+    async def _add_image_bytes(self,data):
+        '''
+        内存中的图片，以 base64:// 发送，不落盘
+        :param data: 图片数据 bytes
+        :return:
+        '''
+        await self._add_image(f'base64://{base64.b64encode(data).decode()}')
+
     async def _add_record(self,data):
         '''
         语音
@@ -221,29 +289,50 @@ class Api:
         :param msg: 自由构造
         :return: None
         '''
-        url = f'{api_url}/send_msg'
+        url = f'{get_api_url()}/send_msg'
         if msg != []:
             msg = msg
         else:
+            # 先取走缓冲区，避免并发的处理器在发送期间往同一个列表里追加
             msg = self.message
-        body = {"message_type": message_type, "message": msg}
+            self.message = []
         if text is not None:
-            await self._add_text(text)
+            msg = msg + [{'type':'text','data':{'text':text}}]
         else:
             pass
+        body = {"message_type": message_type, "message": msg}
         if message_type == 'private':
             body['user_id'] = user_id
         if message_type == 'group':
             body['group_id'] = group_id
         await self._post(url=url,json=body)
-        self.message = []
 
 
     async def send_group_forward_msg(self,group_id,text,nickname="小辞",user_id=3204461757):
-        url = f"{api_url}/send_group_forward_msg"
+        content = [{
+            'type':'text',
+            'data':{'text':text}
+        }]
+        await self._send_forward(group_id,[self._node(nickname,user_id,content)])
+
+    async def send_group_forward_text(self,group_id,text,chunk_size=FORWARD_CHUNK_SIZE,nickname="小辞",user_id=3204461757):
+        '''
+        长文本按行切成多个节点，合并转发一次发出（不截断）
+        :param group_id: 群号
+        :param text: str|Iterable[str]|AsyncIterable[str]，可边生成边切分
+        :param chunk_size: 每个节点的最大字符数
+        :return: None
+        '''
         msg = []
-        content = []
-        card = {
+        async for chunk in chunk_text(text,chunk_size):
+            msg.append(self._node(nickname,user_id,[{'type':'text','data':{'text':chunk}}]))
+        if not msg:
+            msg.append(self._node(nickname,user_id,[{'type':'text','data':{'text':'（无内容）'}}]))
+        await self._send_forward(group_id,msg)
+
+    @staticmethod
+    def _node(nickname,user_id,content):
+        return {
                 "type": "node",
                 "data": {
                     "nickname": nickname,
@@ -251,12 +340,9 @@ class Api:
                     "content": content
                 }
             }
-        text = {
-            'type':'text',
-            'data':{'text':text}
-        }
-        content.append(text)
-        msg.append(card)
+
+    async def _send_forward(self,group_id,msg):
+        url = f"{get_api_url()}/send_group_forward_msg"
         body = {
             "group_id": group_id,
             "message": msg,
@@ -269,5 +355,162 @@ class Api:
         }
         await self._post(url=url,json=body)
 
+    async def get_group_msg_history(self,group_id,count=20):
+        '''
+        获取群历史消息
+        :param group_id: 群号
+        :param count: 条数
+        :return: 消息事件列表（失败返回[]）
+        '''
+        url = f'{get_api_url()}/get_group_msg_history'
+        data = await self._post(url=url,json={'group_id':group_id,'count':count})
+        return ((data or {}).get('data') or {}).get('messages') or []
+
+    async def get_group_info(self,group_id,no_cache=False):
+        '''
+        群信息（带缓存）
+        :param no_cache: True 时强制刷新
+        :return: dict|None
+        '''
+        return await meta_cache.group_info(group_id,no_cache)
+
+    async def get_group_member_list(self,group_id,no_cache=False):
+        '''
+        群成员列表（带缓存）
+        :return: {user_id: 成员信息}|None
+        '''
+        return await meta_cache.members(group_id,no_cache)
+
+    async def get_group_member_info(self,group_id,user_id,no_cache=False):
+        '''
+        群成员信息（带缓存，成员列表已缓存时直接查表）
+        :return: dict|None
+        '''
+        return await meta_cache.member(group_id,user_id,no_cache)
+
+
+class MetaCache:
+    '''
+    群信息/成员缓存：按账号隔离，TTL 过期；同一个 key 同时只发一个请求，其余等待结果
+    成员变动的通知事件会直接修改或清除对应缓存
+    '''
+    def __init__(self,ttl=META_TTL,max_entries=META_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}  # key -> (过期时间, 值)
+        self.inflight = {}  # key -> Future
+        self.api = Api()
+
+    async def _call(self,action,**params):
+        data = await self.api._post(url=f'{get_api_url()}/{action}',json=params)
+        if not data or data.get('retcode',0) != 0:
+            return None
+        return data.get('data')
+
+    def _fresh(self,key):
+        hit = self.entries.get(key)
+        if hit and hit[0] > time.monotonic():
+            return hit[1]
+        return None
+
+    def _store(self,key,value):
+        if len(self.entries) >= self.max_entries:
+            now = time.monotonic()
+            for k in [k for k,(expires,_) in self.entries.items() if expires <= now]:
+                del self.entries[k]
+            if len(self.entries) >= self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = (time.monotonic() + self.ttl,value)
+
+    async def _load(self,key,loader,no_cache=False):
+        if not no_cache:
+            value = self._fresh(key)
+            if value is not None:
+                return value
+        future = self.inflight.get(key)
+        if future:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await loader()
+            if value is not None:
+                self._store(key,value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有其他等待者时避免 "exception was never retrieved"
+            raise
+        finally:
+            # 发起加载的调用被取消（如处理器超时）时也要唤醒其他等待者，按未取到处理
+            if not future.done():
+                future.set_result(None)
+            self.inflight.pop(key,None)
+
+    async def group_info(self,group_id,no_cache=False):
+        key = (get_api_url(),'group',group_id)
+        return await self._load(key,lambda: self._call('get_group_info',group_id=group_id),no_cache)
+
+    async def members(self,group_id,no_cache=False):
+        async def loader():
+            data = await self._call('get_group_member_list',group_id=group_id)
+            return None if data is None else {m.get('user_id'): m for m in data}
+        key = (get_api_url(),'members',group_id)
+        return await self._load(key,loader,no_cache)
+
+    async def member(self,group_id,user_id,no_cache=False):
+        if not no_cache:
+            members = self._fresh((get_api_url(),'members',group_id))
+            if members is not None and user_id in members:
+                return members[user_id]
+        key = (get_api_url(),'member',group_id,user_id)
+        return await self._load(key,lambda: self._call('get_group_member_info',group_id=group_id,user_id=user_id),no_cache)
+
+    async def prefetch(self,group_ids):
+        '''
+        批量预取成员列表（已缓存的跳过）
+        :param group_ids: 群号列表
+        '''
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        async def one(group_id):
+            async with semaphore:
+                try:
+                    await self.members(group_id)
+                except Exception:
+                    pass
+        await asyncio.gather(*(one(g) for g in group_ids if self._fresh((get_api_url(),'members',g)) is None))
+
+    def on_notice(self,event):
+        '''
+        根据通知事件更新缓存：入群/退群/改名片/管理员变动
+        '''
+        notice_type = event.get('notice_type')
+        group_id = event.get('group_id')
+        user_id = event.get('user_id')
+        if not group_id or notice_type not in ('group_increase','group_decrease','group_card','group_admin'):
+            return
+        url = get_api_url()
+        self.entries.pop((url,'member',group_id,user_id),None)
+        hit = self.entries.get((url,'members',group_id))
+        members = hit[1] if hit else None
+        if notice_type == 'group_increase':
+            self.entries.pop((url,'group',group_id),None)  # 成员数变化
+            self.entries.pop((url,'members',group_id),None)
+        elif notice_type == 'group_decrease':
+            self.entries.pop((url,'group',group_id),None)
+            if user_id == event.get('self_id'):
+                self.entries.pop((url,'members',group_id),None)
+            elif members is not None:
+                members.pop(user_id,None)
+        elif members is not None and user_id in members:
+            if notice_type == 'group_card':
+                members[user_id]['card'] = event.get('card_new','')
+            else:
+                members[user_id]['role'] = 'admin' if event.get('sub_type') == 'set' else 'member'
+
+
+meta_cache = MetaCache()
+
 
 api = Api()
\ No newline at end of file
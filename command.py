@@ -1,26 +1,75 @@
 from message import message
-from api import Api
+from api import Api, meta_cache
 import re
 import uuid
+import time
+import asyncio
 import json
+import functools
+from collections import OrderedDict
+from urllib.parse import urlsplit
 from typing import List, Union, Optional, Callable
 from loguru import logger
+from worker import run_cpu
+from limiter import get_limit, SlidingWindow
+from history import history_store
+import group_config
+import tracing
 
 # ========== 全局变量 ==========
-PROCESSED_MSG_IDS = set()  # 全局去重，避免重复触发
+PROCESSED_MSG_IDS = OrderedDict()  # 全局去重，避免重复触发；按处理顺序保存，淘汰时先丢最旧的
 MAX_PROCESSED_CACHE = 1000  # 缓存上限，防止内存溢出
 
 # 处理器注册表：按类型分类
 HANDLERS = {
     "global": [],  # 全局监听（on_command() 不传参）
     "command": {},  # 普通文本命令（如 on_command("你好")）
-    "regex": []  # 正则匹配（如 on_command(r"^测.*试$")）
+    "regex": [],  # 正则匹配（如 on_command(r"^测.*试$")）
+    "event": {},  # 通知/请求/元事件：(post_type, 细分类型, sub_type) -> [处理器]
+    "card": {}  # 卡片消息：("app"|"appid"|"host", 值) -> [处理器]
 }
 
+# 各 post_type 的细分类型字段
+EVENT_DETAIL_KEYS = {
+    "notice": "notice_type",
+    "request": "request_type",
+    "meta_event": "meta_event_type"
+}
+
+# 过载保护：排队数量或等待时间超过阈值时逐级降级
+DISPATCH_WORKERS = 4  # 每个连接的并发分发协程数
+MAX_QUEUE = 500  # 排队上限，满了直接丢弃新消息
+SHED_DEPTH, SHED_AGE = 50, 10  # 超过后跳过低优先级的全局监听
+BUSY_DEPTH, BUSY_AGE = 100, 30  # 超过后高开销命令直接回复"繁忙"
+BUSY_REPLY_WINDOW = 60  # 同一个群/私聊用户在这段时间（秒）内最多收到一次"繁忙"回复
+DROP_AGE = 120  # 排队超过这么久的消息直接丢弃，回复已经没有意义
+
+# 处理器默认优先级（数字越小越先执行）和默认超时
+DEFAULT_PRIORITY = {"command": 1, "regex": 2, "card": 3, "global": 5}
+HANDLER_TIMEOUT = 120
+
+# 分发统计（可通过「运行状态」指令查看）
+DISPATCH_STATS = {
+    "received": 0,  # 入队消息数
+    "dropped": 0,  # 队列满/排队过久丢弃
+    "shed_global": 0,  # 跳过的全局监听
+    "busy_reply": 0,  # 高开销命令回复繁忙
+    "busy_skipped": 0,  # 繁忙时被限流或已提示过、直接丢弃的高开销命令
+    "max_age": 0.0  # 最大排队时间（秒）
+}
+DISPATCHERS = []  # 所有连接的分发器
+BACKGROUND_TASKS = set()  # spawn() 启动的后台任务，持有引用直到结束
+
 # 卡片消息专属标识（用于生成唯一ID）
 ARK_MSG_PREFIX = "ark_"
 
 
+# ========== 工具函数：群开关判断 ==========
+def is_disabled(mask: int, handler) -> bool:
+    """处理器在群禁用位图里是否被关闭（没有名称的处理器不受群开关控制）"""
+    return handler.hid is not None and bool(mask >> handler.hid & 1)
+
+
 # ========== 工具函数：判断是否为正则表达式 ==========
 def is_regex_pattern(pattern: str) -> bool:
     """简单判断字符串是否为正则表达式（通过正则元字符+编译验证）"""
@@ -40,15 +89,36 @@ def is_regex_pattern(pattern: str) -> bool:
 
 # ========== 核心处理器类（整合所有类型） ==========
 class CommandHandler(Api):
-    def __init__(self, pattern: Optional[Union[str, List[str]]] = None):
+    def __init__(self, pattern: Optional[Union[str, List[str]]] = None, rate: Optional[tuple] = None,
+                 per: str = "user", max_concurrent: Optional[int] = None, on_limit: str = "reply",
+                 heavy: bool = False, priority: Optional[int] = None, block: Optional[bool] = None,
+                 timeout: Optional[float] = HANDLER_TIMEOUT, name: Optional[str] = None):
         """
         统一处理器：
         - 不传参 (pattern=None) → 全局监听（所有消息：文本/卡片/图片等）
         - 传普通字符串 → 普通命令
         - 传正则字符串 → 正则匹配
+        限流（可选）：
+        - rate=(次数, 秒) → 窗口内最多调用次数，per 指定按 user/group/global 计数
+        - max_concurrent → 同时执行的最大数量
+        - on_limit → 超限时 drop 静默丢弃 / reply 提示一次 / queue 排队等待
+        heavy=True → 高开销命令（模型调用、浏览器等），过载时直接回复繁忙
+        调度：
+        - priority → 数字越小越先执行，默认 命令1 < 正则2 < 卡片3 < 全局5
+        - block → 执行后是否阻止更低优先级的处理器，默认全局监听不阻止、其他阻止
+        - timeout → 单个处理器超时（秒），None 为不限
+        name → 群开关配置里使用的名称，默认为命令本身；不传参的全局监听和卡片处理器需指定 name 才能按群开关
         """
         super().__init__()
         self.pattern = pattern
+        self.heavy = heavy
+        self.priority = priority
+        self.block = block
+        self.timeout = timeout
+        self.name = name
+        self.limit_config = None
+        if rate or max_concurrent:
+            self.limit_config = {"rate": rate, "per": per, "max_concurrent": max_concurrent, "on_limit": on_limit}
         self.handler_type = "global"  # 默认全局监听
         self.compiled_regex = None
         self.commands = []
@@ -84,13 +154,32 @@ class CommandHandler(Api):
                     HANDLERS["command"][f"/{cmd}"] = wrapped_func  # 兼容 /命令 格式
             elif self.handler_type == "regex":
                 HANDLERS["regex"].append((self.compiled_regex, wrapped_func))
+            elif self.handler_type == "card":
+                for key in self.card_keys:
+                    HANDLERS["card"].setdefault(key, []).append(wrapped_func)
 
             return func
 
         return decorator
 
     def _wrap_handler(self, func):
-        async def wrapper(text="", match=None, ark_data=None):
+        # 群开关使用的名称：未指定时为命令/正则本身；没有名称的全局监听/卡片处理器不参与群开关
+        name = self.name or (self.commands[0] if self.commands else None)
+        label = name or f"{func.__module__}:{func.__code__.co_firstlineno}"  # 没有名称时才用定义行号
+        # 限流状态按 模块+名称 保存（插件里函数常同名为 _），插件 reload、改动行号后都不会清零
+        limit = None
+        if self.limit_config:
+            limit = get_limit(f"{func.__module__}:{label}", **self.limit_config)
+
+        @functools.wraps(func)  # 保留 __module__，reload 时按模块注销
+        @tracing.traced(f"处理器 {label}")
+        async def wrapper(text="", match=None, ark_data=None, extra=None):
+            # 限流在构造 ctx 之前判断，被拦截的消息几乎没有开销
+            if limit and not await limit.enter(message.user_id, message.group_id):
+                tracing.annotate(limited=True)
+                if limit.should_reply(message.user_id, message.group_id):
+                    await self.send_msg(group_id=message.group_id, text="操作太频繁啦，请稍后再试")
+                return
             try:
                 # 构造上下文：包含所有消息类型的关键信息
                 ctx = {
@@ -100,17 +189,35 @@ class CommandHandler(Api):
                     "text": text,  # 文本内容（文本消息）
                     "match": match,  # 正则匹配结果（正则消息）
                     "ark_data": ark_data,  # 卡片数据（卡片消息）
-                    "msg_type": self._get_msg_type(text, ark_data)  # 消息类型标识
+                    "msg_type": self._get_msg_type(text, ark_data),  # 消息类型标识
+                    "run_cpu": run_cpu,  # CPU密集任务放进程池：await ctx["run_cpu"](func, *args)
+                    "history": history_store.group(message.self_id, message.group_id),  # 本群最近消息（私聊为None）
+                    "reply": history_store.reply_target(message.raw_data)  # 被回复的消息（不在缓冲里为None）
                 }
-                await func(ctx)
+                if extra:
+                    ctx.update(extra)
+                await asyncio.wait_for(func(ctx), self.timeout)
+            except asyncio.TimeoutError:
+                tracing.annotate(timeout=True)
+                logger.warning(f"处理器 {func.__module__}.{func.__qualname__} 超过 {self.timeout} 秒，已取消")
             except Exception as e:
+                tracing.annotate(error=repr(e)[:200])
                 logger.error(f"处理器执行出错: {e}")
                 # 异常回复（保证机器人不崩溃）
                 await self.send_msg(
                     group_id=message.group_id,
                     text=f"处理消息时出错啦 😥\n错误详情: {str(e)[:200]}"
                 )
+            finally:
+                if limit:
+                    limit.leave()
 
+        wrapper.heavy = self.heavy
+        wrapper.limit = limit  # 繁忙降级时不执行 wrapper，也要先过限流
+        wrapper.priority = DEFAULT_PRIORITY[self.handler_type] if self.priority is None else self.priority
+        wrapper.block = self.handler_type != "global" if self.block is None else self.block
+        # 群开关位图里的序号：按名称分配，插件 reload 后不变；不按行号分配，否则每次改插件都会占用新的位
+        wrapper.hid = group_config.handler_id(name) if name else None
         return wrapper
 
     def _get_msg_type(self, text: str, ark_data: dict) -> str:
@@ -123,20 +230,234 @@ class CommandHandler(Api):
             return "other"  # 图片、语音、表情等
 
 
+# ========== 卡片处理器（按 app/appid/跳转域名 索引） ==========
+class CardHandler(CommandHandler):
+    def __init__(self, app: Optional[str] = None, appid: Optional[Union[str, int]] = None,
+                 host: Optional[str] = None, fields: Optional[List[str]] = None, **options):
+        """
+        卡片处理器：app/appid/host 任一命中即触发（都查表，O(1)）
+        - host 匹配跳转链接域名，注册 "kuaishou.com" 也能匹配 "v.kuaishou.com"
+        - fields 为需要的字段路径（如 "meta.news.jumpUrl"），提取后放在 ctx["fields"]
+        """
+        super().__init__(pattern=None, **options)
+        self.handler_type = "card"
+        self.fields = fields or []
+        self.card_keys = []
+        if app:
+            self.card_keys.append(("app", app))
+        if appid:
+            self.card_keys.append(("appid", str(appid)))
+        if host:
+            self.card_keys.append(("host", host.lower()))
+
+    def _wrap_handler(self, func):
+        wrapper = super()._wrap_handler(func)
+        wrapper.card_fields = self.fields
+        return wrapper
+
+
+def get_path(data, path: str):
+    """按 a.b.c 取嵌套字段，不存在返回 None"""
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def card_jump_url(ark_data: dict) -> str:
+    """卡片的跳转链接：meta 下第一层里的 jumpUrl/qqdocurl"""
+    meta = ark_data.get("meta")
+    if isinstance(meta, dict):
+        for item in meta.values():
+            if isinstance(item, dict):
+                url = item.get("jumpUrl") or item.get("qqdocurl")
+                if url:
+                    return url
+    return ""
+
+
+def match_card_handlers(ark_data: dict) -> tuple:
+    """
+    查表找到卡片对应的处理器：app、appid、跳转域名及其上级域名
+    :return: (处理器列表, 跳转链接)
+    """
+    table = HANDLERS["card"]
+    if not table:
+        return [], ""
+    keys = [("app", ark_data.get("app")), ("appid", str(get_path(ark_data, "extra.appid") or ""))]
+    jump_url = card_jump_url(ark_data)
+    host = (urlsplit(jump_url).hostname or "") if jump_url else ""
+    labels = host.split(".")
+    keys += [("host", ".".join(labels[i:])) for i in range(len(labels) - 1)]
+
+    handlers = []
+    for key in keys:
+        for handler in table.get(key, ()):
+            if handler not in handlers:
+                handlers.append(handler)
+    return handlers, jump_url
+
+
+# ========== 事件处理器（通知/请求/元事件） ==========
+class EventHandler(Api):
+    def __init__(self, post_type: str, detail_type: Optional[str] = None, sub_type: Optional[str] = None):
+        """
+        非消息事件处理器，detail_type/sub_type 为 None 时匹配该层级的所有事件
+        - post_type: notice|request|meta_event
+        - detail_type: notice_type|request_type|meta_event_type 的值
+        - sub_type: 事件子类型
+        """
+        super().__init__()
+        self.key = (post_type, detail_type, sub_type if detail_type else None)
+        self.func = None
+
+    def box(self):
+        def decorator(func):
+            self.func = func
+            HANDLERS["event"].setdefault(self.key, []).append(self._wrap_handler(func))
+            return func
+
+        return decorator
+
+    def _wrap_handler(self, func):
+        @functools.wraps(func)
+        async def wrapper(event: dict):
+            try:
+                ctx = {
+                    "post_type": event.get("post_type"),  # 事件大类
+                    "detail_type": event.get(EVENT_DETAIL_KEYS.get(event.get("post_type"), ""), ""),  # 细分类型
+                    "sub_type": event.get("sub_type", ""),  # 子类型
+                    "self_id": event.get("self_id", 0),  # 机器人QQ
+                    "group_id": event.get("group_id", 0),  # 群ID（群相关事件）
+                    "user_id": event.get("user_id", 0),  # 事件相关用户
+                    "event": event,  # 原始事件数据
+                    "run_cpu": run_cpu
+                }
+                await asyncio.wait_for(func(ctx), HANDLER_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"事件处理器 {func.__module__}.{func.__qualname__} 超过 {HANDLER_TIMEOUT} 秒，已取消")
+            except Exception as e:
+                logger.error(f"事件处理器执行出错: {e}")
+
+        return wrapper
+
+
 # ========== 统一注册接口（极简版） ==========
-def on_command(pattern: Optional[Union[str, List[str]]] = None):
+def on_command(pattern: Optional[Union[str, List[str]]] = None, **options):
     """
     极简监听接口：
     ✅ on_command() → 监听所有消息（文本/卡片/图片/语音等）
     ✅ on_command("你好") → 监听普通文本命令
     ✅ on_command(r"^测.*试$") → 监听正则匹配的文本消息
+    ✅ on_command("豆包", rate=(3, 60), max_concurrent=2) → 每人每分钟3次，最多同时2个
+    ✅ on_command(priority=4, block=True) → 全局监听，比其他全局监听先执行并拦截它们
+    """
+    return CommandHandler(pattern=pattern, **options)
+
+
+def on_card(app: Optional[str] = None, appid: Optional[Union[str, int]] = None, host: Optional[str] = None,
+            fields: Optional[List[str]] = None, **options):
+    """
+    ✅ on_card(host="kuaishou.com", fields=["meta.news.jumpUrl"]) → 快手分享卡片
+    ✅ on_card(app="com.tencent.miniapp_01") → 指定 app 的卡片
+    命中的卡片不再进入全局监听
+    """
+    return CardHandler(app=app, appid=appid, host=host, fields=fields, **options)
+
+
+def on_notice(notice_type: Optional[str] = None, sub_type: Optional[str] = None):
+    """
+    ✅ on_notice() → 所有通知
+    ✅ on_notice("group_increase") → 群成员增加
+    ✅ on_notice("notify", "poke") → 戳一戳
+    """
+    return EventHandler("notice", notice_type, sub_type)
+
+
+def on_request(request_type: Optional[str] = None, sub_type: Optional[str] = None):
+    """
+    ✅ on_request("friend") → 好友申请
+    ✅ on_request("group", "invite") → 邀请入群
+    """
+    return EventHandler("request", request_type, sub_type)
+
+
+def on_meta(meta_event_type: Optional[str] = None, sub_type: Optional[str] = None):
+    """
+    ✅ on_meta("heartbeat") → 心跳
+    ✅ on_meta("lifecycle", "connect") → 连接建立
+    """
+    return EventHandler("meta_event", meta_event_type, sub_type)
+
+
+# ========== 分发队列（过载保护） ==========
+class Dispatcher:
+    """
+    消息分发队列：接收循环只负责入队，由若干协程并发处理，
+    并根据排队深度和等待时间决定是否降级
     """
-    return CommandHandler(pattern=pattern)
+    def __init__(self, workers: int = DISPATCH_WORKERS, max_queue: int = MAX_QUEUE):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.tasks = []
+        DISPATCHERS.append(self)
+
+    def start(self):
+        """在当前上下文启动分发协程（会继承当前账号的 api 地址）"""
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def put(self, data: dict, root: Optional["tracing.Span"] = None):
+        """
+        :param data: 消息事件，或通知/请求/元事件（同样排队，不在接收循环里执行）
+        :param root: 接收时创建的追踪，随消息入队，处理完后结束
+        """
+        DISPATCH_STATS["received"] += 1
+        try:
+            self.queue.put_nowait((time.monotonic(), data, root))
+        except asyncio.QueueFull:
+            DISPATCH_STATS["dropped"] += 1
+            tracing.finish(root, dropped="队列已满")
+            logger.warning("分发队列已满，丢弃消息")
+
+    async def _worker(self):
+        while True:
+            queued_at, data, root = await self.queue.get()
+            age = time.monotonic() - queued_at
+            try:
+                DISPATCH_STATS["max_age"] = max(DISPATCH_STATS["max_age"], age)
+                if age > DROP_AGE:
+                    DISPATCH_STATS["dropped"] += 1
+                    tracing.finish(root, queue_ms=round(age * 1000, 1), dropped="排队超时")
+                    continue
+                # contextvar 不会跟着队列走，在这里重新激活接收时的追踪
+                with tracing.use(root):
+                    if "message_type" in data:
+                        await message._set_message_data(data)
+                        await process_message(age=age, depth=self.queue.qsize())
+                    else:
+                        await process_event(data)
+            except Exception as e:
+                logger.error(f"消息分发出错: {e}")
+            finally:
+                tracing.finish(root, queue_ms=round(age * 1000, 1))
+                self.queue.task_done()
+
+
+_busy_api = Api()
+_busy_notices = SlidingWindow(1, BUSY_REPLY_WINDOW)
 
 
 # ========== 消息处理入口（核心逻辑） ==========
-async def process_message():
-    global PROCESSED_MSG_IDS
+@tracing.traced("分发")
+async def process_message(age: float = 0, depth: int = 0):
+    """
+    :param age: 消息排队时间（秒）
+    :param depth: 当前排队数量
+    """
+    shed = age > SHED_AGE or depth > SHED_DEPTH
+    busy = age > BUSY_AGE or depth > BUSY_DEPTH
 
     # 1. 解析消息内容（提取文本/卡片/其他类型）
     msg_text = ""  # 文本内容
@@ -171,44 +492,149 @@ async def process_message():
     else:
         final_msg_id = f"other_{message.group_id}_{str(uuid.uuid4())}"
 
+    # 多账号时不同账号的消息ID可能相同，按账号区分
+    final_msg_id = f"{getattr(message, 'self_id', 0)}:{final_msg_id}"
+
     # 3. 去重判断：已处理过则直接返回
     if final_msg_id in PROCESSED_MSG_IDS:
         logger.debug(f"消息已处理，跳过：{final_msg_id}")
+        tracing.annotate(duplicate=True)
         return
-    PROCESSED_MSG_IDS.add(final_msg_id)
+    PROCESSED_MSG_IDS[final_msg_id] = None
+    history_store.add(message.raw_data)
 
-    # 4. 清理缓存（防止内存溢出）
-    if len(PROCESSED_MSG_IDS) > MAX_PROCESSED_CACHE:
-        # 保留后50%的缓存，避免频繁清理
-        PROCESSED_MSG_IDS = set(list(PROCESSED_MSG_IDS)[-MAX_PROCESSED_CACHE // 2:])
-        logger.debug(f"清理消息缓存，当前缓存量：{len(PROCESSED_MSG_IDS)}")
+    # 4. 清理缓存（防止内存溢出）：淘汰最早处理的，断线补偿重新拉取的最近消息始终在缓存里
+    while len(PROCESSED_MSG_IDS) > MAX_PROCESSED_CACHE:
+        PROCESSED_MSG_IDS.popitem(last=False)
 
-    # 5. 消息匹配逻辑（优先级：精准匹配 > 全局监听）
-    # 5.1 优先匹配普通命令（文本消息）
+    # 5. 收集所有命中的处理器：(处理器, 参数)；本群关闭的处理器直接跳过，不做匹配
+    disabled = group_config.disabled_mask(message.group_id)
+    candidates = []
+    # 5.1 普通命令（文本消息）
     if msg_text and msg_text in HANDLERS["command"]:
-        await HANDLERS["command"][msg_text](text=msg_text)
-        return
+        handler = HANDLERS["command"][msg_text]
+        if not is_disabled(disabled, handler):
+            candidates.append((handler, {"text": msg_text}))
 
-    # 5.2 匹配正则命令（文本消息）
+    # 5.2 正则命令（文本消息）
     if msg_text:
         for compiled_pattern, handler in HANDLERS["regex"]:
+            if is_disabled(disabled, handler):
+                continue
             match = compiled_pattern.fullmatch(msg_text)
             if match:
-                await handler(text=msg_text, match=match)
-                return
+                candidates.append((handler, {"text": msg_text, "match": match}))
+
+    # 5.3 卡片处理器（查表分发）
+    if ark_data:
+        card_handlers, jump_url = match_card_handlers(ark_data)
+        for handler in card_handlers:
+            if is_disabled(disabled, handler):
+                continue
+            fields = {path: get_path(ark_data, path) for path in handler.card_fields}
+            candidates.append((handler, {"text": msg_text, "ark_data": ark_data,
+                                         "extra": {"fields": fields, "jump_url": jump_url}}))
+
+    # 5.4 全局监听（所有类型：卡片/文本/其他），过载时最先被丢弃
+    if shed and HANDLERS["global"]:
+        DISPATCH_STATS["shed_global"] += 1
+    else:
+        for handler in HANDLERS["global"]:
+            if not is_disabled(disabled, handler):
+                candidates.append((handler, {"text": msg_text, "ark_data": ark_data}))
+
+    tracing.annotate(candidates=len(candidates), shed=shed, busy=busy)
+    await run_candidates(candidates, busy)
 
-    # 5.3 全局监听（所有类型：卡片/文本/其他）
-    if HANDLERS["global"]:
-        for global_handler in HANDLERS["global"]:
-            await global_handler(text=msg_text, ark_data=ark_data)
-            # 全局监听默认只执行第一个处理器（避免多处理器重复回复）
-            # 如需执行所有全局处理器，注释下面的return
+
+async def run_candidates(candidates: list, busy: bool = False):
+    """
+    按优先级从小到大分批执行：同一优先级并发执行（各自有超时），
+    这一批里有 block=True 的处理器时不再执行后面的优先级
+    """
+    candidates.sort(key=lambda item: item[0].priority)  # 稳定排序，同优先级保持注册顺序
+    index = 0
+    while index < len(candidates):
+        priority = candidates[index][0].priority
+        batch = []
+        while index < len(candidates) and candidates[index][0].priority == priority:
+            batch.append(candidates[index])
+            index += 1
+
+        jobs = []
+        reply_busy = False
+        for handler, kwargs in batch:
+            if not (busy and handler.heavy):
+                jobs.append(handler(**kwargs))
+            elif handler.limit and not handler.limit.check(message.user_id, message.group_id):
+                DISPATCH_STATS["busy_skipped"] += 1  # 本来就会被限流的刷屏消息，不再额外回复
+            else:
+                reply_busy = True
+        if reply_busy:
+            jobs.append(_reply_busy())  # 同一批多个高开销处理器只回复一次繁忙
+        await asyncio.gather(*jobs, return_exceptions=True)
+        if any(handler.block for handler, _ in batch):
             return
 
 
+async def _reply_busy():
+    # 按群（私聊按用户）在窗口内只回复一次，刷屏时不会每条消息都多发一次请求
+    key = (message.self_id, message.group_id or f"u{message.user_id}")
+    if not _busy_notices.hit(key):
+        DISPATCH_STATS["busy_skipped"] += 1
+        return
+    DISPATCH_STATS["busy_reply"] += 1
+    await _busy_api.send_msg(group_id=message.group_id, text="机器人当前繁忙，请稍后再试")
+
+
+# ========== 非消息事件入口 ==========
+async def process_event(event: dict):
+    """
+    通知/请求/元事件分发：按 精确 → 忽略子类型 → 整个大类 三次字典查找
+    """
+    post_type = event.get("post_type")
+    if post_type == "notice":
+        meta_cache.on_notice(event)  # 成员变动先更新缓存，处理器里读到的就是新数据
+    detail_type = event.get(EVENT_DETAIL_KEYS.get(post_type, ""))
+    sub_type = event.get("sub_type")
+    table = HANDLERS["event"]
+    # 按 精确 → 细分类型 → 大类 的顺序执行；detail/sub_type 为空时几个键相同，去重但保持顺序
+    keys = dict.fromkeys(((post_type, detail_type, sub_type), (post_type, detail_type, None), (post_type, None, None)))
+    for key in keys:
+        for handler in table.get(key, ()):
+            await handler(event)
+
+
+# ========== 辅助函数：注销模块的处理器 ==========
+def clear_module_handlers(module_name: str):
+    """移除某个模块注册的全部处理器（reload 插件前调用，避免重复注册）"""
+    def keep(handler):
+        return getattr(handler, "__module__", None) != module_name
+
+    HANDLERS["global"][:] = [h for h in HANDLERS["global"] if keep(h)]
+    HANDLERS["regex"][:] = [(p, h) for p, h in HANDLERS["regex"] if keep(h)]
+    for cmd in [c for c, h in HANDLERS["command"].items() if not keep(h)]:
+        del HANDLERS["command"][cmd]
+    for table in (HANDLERS["event"], HANDLERS["card"]):
+        for key, handlers in list(table.items()):
+            handlers[:] = [h for h in handlers if keep(h)]
+            if not handlers:
+                del table[key]
+
+
+# ========== 辅助函数：后台任务 ==========
+def spawn(coro) -> asyncio.Task:
+    """
+    启动后台任务并保存引用：事件循环只保留弱引用，直接 create_task 不保存的话可能在运行中被回收
+    """
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+
 # ========== 辅助函数：清理缓存 ==========
 def clear_processed_cache():
     """清空已处理消息缓存（手动调用）"""
-    global PROCESSED_MSG_IDS
     PROCESSED_MSG_IDS.clear()
     logger.info("已清空消息去重缓存")
\ No newline at end of file
@@ -1,19 +1,47 @@
-from command import on_command
+import command
+from command import on_command, on_notice, on_card
+from scheduler import on_schedule, scheduler
 from message import message
-import sys,asyncio,requests as fw,json,os
-from plugin import md2img
-from io import StringIO
-from plugin.chat import chat_manager
-from plugin.ks_video import extract_ks_video
+from api import Api
+import sys,json,time
+from loader import lazy_module
+from plugin import pyexec
+
+# 依赖 playwright/markdown/requests 的插件在第一次用到时才导入，加快启动
+md2img = lazy_module("plugin.md2img")
+chat_plugin = lazy_module("plugin.chat")
+ks_video = lazy_module("plugin.ks_video")
+import profiler
+import group_config
+import media_cache
+import tracing
+
+ADMIN_ID = 2163712324  # 管理员QQ（执行/性能分析等敏感指令）
+TILES_PER_MESSAGE = 3  # 长图分片时每条消息最多几张图
+EXEC_PARTIAL_INTERVAL = 5  # 执行任务运行中回传部分输出的间隔（秒）
 
 a = on_command("测试")
 b = on_command(["帮助", "help", "菜单"])
 c = on_command("你好")
 d = on_command(["结束",'退出'])
-send = on_command(r'发送 ([\s\S]+)')
-op = on_command(r'/?执行[\n\r]([\s\S]+)')
-chat = on_command(r'/?豆包 ?([\s\S]+)')
-card = on_command()
+send = on_command(r'发送 ([\s\S]+)', name="发送")
+op = on_command(r'/?执行[\n\r]([\s\S]+)', name="执行")
+op_cancel = on_command(r'/?终止执行 ?(\d+)', name="终止执行")
+chat = on_command(r'/?豆包 ?([\s\S]+)', rate=(3, 60), max_concurrent=4, heavy=True, name="豆包")
+card = on_command(name="卡片调试")
+ks_card = on_card(host="v.kuaishou.com", fields=["meta.news.jumpUrl"], heavy=True, timeout=240, name="快手解析")  # 解析最长约125秒 + 下载90秒
+prof = on_command(r'/?性能分析 ?(\d*)', name="性能分析")
+mem = on_command(r'/?内存(基线|快照)', name="内存快照")
+status = on_command(r'/?运行状态', name="运行状态")
+traces = on_command(r'/?追踪 ?(\d*) ?(\S*)', name="追踪")
+summary = on_command(r'/?总结 ?(\d*)', rate=(2, 300), per="group", heavy=True, name="总结")
+switch = on_command(r'/?(启用|禁用) ?(.+)', name="功能开关")
+reload_config = on_command(r'/?重载群配置', name="重载群配置")
+poke = on_notice("notify", "poke")
+remind = on_command(r'/?提醒 ?(\d+) ?(秒|分钟|小时)后? ?([\s\S]+)', name="提醒")
+remind_job = on_schedule("提醒")
+
+REMIND_UNITS = {'秒': 1, '分钟': 60, '小时': 3600}
 
 @a.box()
 async def _(ctx):
@@ -47,18 +75,24 @@ async def _(ctx):
     try:
         user_input = ctx["match"].group(1)
         session_id = message.group_id
-        reply = await chat_manager.get_chat_reply(session_id, user_input)
+        reply = await chat_plugin.chat_manager.get_chat_reply(session_id, user_input)
         msg = []
-        path = False
-        if len(reply) > 150:
-            img_path = os.path.join(os.getcwd(), f"md_img_{message.user_id}.png")
-            path = await md2img.md_to_image_async(f'{reply}',img_path)
-        if path:
-            await chat._add_image(f'file://{path}')
-        else:
-            await chat._add_text(f'{reply}')
+        if reply and len(reply) > 150:
+            # 长回复按块分片渲染，以 base64 发送；每凑够几张先发出去，不在内存里攒整张长图
+            sent = False
+            builder = Api()
+            async for tile in md2img.md_to_image_tiles(f'{reply}', image_format='jpeg'):
+                await builder._add_image_bytes(tile)
+                if len(builder.message) >= TILES_PER_MESSAGE:
+                    await builder.send_msg(group_id=message.group_id)
+                    sent = True
+            if builder.message:
+                await builder.send_msg(group_id=message.group_id)
+                sent = True
+            if sent:
+                return
         if reply:
-            await chat.send_msg(group_id=message.group_id)
+            await chat.send_msg(group_id=message.group_id, text=f'{reply}')
         else:
             await chat.send_msg(group_id=message.group_id, text="抱歉，我暂时无法回答，请稍后再试！")
     except Exception as e:
@@ -66,19 +100,155 @@ async def _(ctx):
 
 @op.box()
 async def _(ctx):
-    if message.user_id != 2163712324:
+    if message.user_id != ADMIN_ID:
         await op.send_msg(group_id=message.group_id,text='禁止使用！')
     else:
-        code = ctx['match'].group(1)
-        old = sys.stdout
-        new = StringIO()
-        sys.stdout = new
+        # 在独立子进程中执行，卡死或死循环不会拖住机器人
+        job = pyexec.ExecJob(ctx['match'].group(1))
+        await job.start()
+        output, pending = [], ''
+        last = time.monotonic()
+        async for piece in job.stream():
+            output.append(piece)
+            pending += piece
+            # 长时间运行的任务定期回传部分输出
+            if time.monotonic() - last > EXEC_PARTIAL_INTERVAL and pending.strip():
+                await op.send_msg(group_id=message.group_id, text=f'任务{job.id}运行中（终止执行 {job.id}）：\n{pending[-500:]}')
+                pending = ''
+                last = time.monotonic()
+        op_1 = ''.join(output)
+        await op.send_group_forward_text(message.group_id, f'执行结果（任务{job.id}）：\n{op_1}')
+
+@op_cancel.box()
+async def _(ctx):
+    if message.user_id != ADMIN_ID:
+        await op_cancel.send_msg(group_id=message.group_id, text='禁止使用！')
+        return
+    job_id = int(ctx['match'].group(1))
+    ok = pyexec.cancel(job_id)
+    await op_cancel.send_msg(group_id=message.group_id, text=f'已终止任务{job_id}' if ok else f'任务{job_id}不存在或已结束')
+
+
+@prof.box()
+async def _(ctx):
+    if message.user_id != ADMIN_ID:
+        await prof.send_msg(group_id=message.group_id, text='禁止使用！')
+        return
+    group_id = message.group_id
+    seconds = int(ctx['match'].group(1) or 10)
+
+    async def run():
+        # 采集期间不能阻塞消息循环，否则采不到任何东西
         try:
-            exec(code)
-        finally:
-            sys.stdout = old
-        op_1 = new.getvalue()
-        await op.send_msg(group_id=message.group_id, text=f'执行结果：\n{op_1}')
+            report = await profiler.profile_loop(seconds)
+        except RuntimeError as e:
+            await prof.send_msg(group_id=group_id, text=str(e))
+            return
+        profiler.write_report("cprofile", report)
+        await prof.send_group_forward_text(group_id, report)
+
+    command.spawn(run())
+    await prof.send_msg(group_id=group_id, text=f'开始性能采集，{min(seconds, profiler.MAX_PROFILE_SECONDS)}秒后发送结果')
+
+@mem.box()
+async def _(ctx):
+    if message.user_id != ADMIN_ID:
+        await mem.send_msg(group_id=message.group_id, text='禁止使用！')
+        return
+    if ctx['match'].group(1) == '基线':
+        await mem.send_msg(group_id=message.group_id, text=profiler.memory_baseline())
+    else:
+        report = profiler.memory_diff()
+        profiler.write_report("memory", report)
+        await mem.send_group_forward_text(message.group_id, report)
+
+
+@summary.box()
+async def _(ctx):
+    # 直接读本地缓冲的最近消息，不请求 NapCat
+    if not ctx['history']:
+        await summary.send_msg(group_id=message.group_id, text='还没有可以总结的消息')
+        return
+    count = int(ctx['match'].group(1) or 30)
+    lines = []
+    # 多个分发协程并发处理，指令之后可能已经有新消息入缓冲，按消息ID去掉「总结」指令本身
+    events = [e for e in ctx['history'].recent(count + 1) if e.get('message_id') != ctx['message_id']]
+    for event in events[-count:]:
+        sender = event.get('sender') or {}
+        name = sender.get('card') or sender.get('nickname') or event.get('user_id')
+        if event.get('raw_message'):
+            lines.append(f"{name}：{event['raw_message']}")
+    if not lines:
+        await summary.send_msg(group_id=message.group_id, text='还没有可以总结的消息')
+        return
+    session_id = f'summary_{message.group_id}'
+    reply = await chat_plugin.chat_manager.get_chat_reply(session_id, '请简要总结以下群聊内容：\n' + '\n'.join(lines))
+    chat_plugin.chat_manager.clear_session_context(session_id)
+    await summary.send_msg(group_id=message.group_id, text=reply or '总结失败，请稍后再试')
+
+@switch.box()
+async def _(ctx):
+    if message.user_id != ADMIN_ID and message.sender_role not in ('owner', 'admin'):
+        await switch.send_msg(group_id=message.group_id, text='只有群主/管理员可以操作')
+        return
+    action, name = ctx['match'].groups()
+    name = name.strip()
+    if name == '功能开关':
+        await switch.send_msg(group_id=message.group_id, text='不能关闭开关本身')
+        return
+    if name not in group_config.HANDLER_IDS:
+        await switch.send_msg(group_id=message.group_id, text=f'没有名为「{name}」的功能')
+        return
+    group_config.set_enabled(message.group_id, name, action == '启用')
+    await switch.send_msg(group_id=message.group_id, text=f'本群已{action}「{name}」')
+
+@reload_config.box()
+async def _(ctx):
+    if message.user_id != ADMIN_ID:
+        await reload_config.send_msg(group_id=message.group_id, text='禁止使用！')
+        return
+    group_config.load()
+    await reload_config.send_msg(group_id=message.group_id, text='群配置已重载')
+
+@status.box()
+async def _(ctx):
+    if message.user_id != ADMIN_ID:
+        await status.send_msg(group_id=message.group_id, text='禁止使用！')
+        return
+    stats = dict(command.DISPATCH_STATS)
+    stats['queue'] = sum(d.queue.qsize() for d in command.DISPATCHERS)
+    lines = [f'{k}: {round(v, 2) if isinstance(v, float) else v}' for k, v in stats.items()]
+    await status.send_msg(group_id=message.group_id, text='运行状态：\n' + '\n'.join(lines))
+
+@traces.box()
+async def _(ctx):
+    # 追踪 [条数] [span名称]：最近最慢的几次处理，按层级列出各阶段耗时
+    if message.user_id != ADMIN_ID:
+        await traces.send_msg(group_id=message.group_id, text='禁止使用！')
+        return
+    top, name = ctx['match'].groups()
+    report = tracing.report(int(top or 5), name or None)
+    await traces.send_group_forward_text(message.group_id, report)
+
+@poke.box()
+async def _(ctx):
+    # 群里戳机器人时回应
+    if ctx['group_id'] and ctx['event'].get('target_id') == ctx['self_id']:
+        await poke.send_msg(group_id=ctx['group_id'], text='戳我干嘛')
+
+
+@remind.box()
+async def _(ctx):
+    amount, unit, text = ctx['match'].groups()
+    scheduler.add_once("提醒", delay=int(amount) * REMIND_UNITS[unit], data={
+        'group_id': message.group_id, 'user_id': message.user_id, 'text': text
+    })
+    await remind.send_msg(group_id=message.group_id, text=f'好的，{amount}{unit}后提醒你')
+
+@remind_job.box()
+async def _(ctx):
+    await remind_job._add_at(ctx['data']['user_id'])
+    await remind_job.send_msg(group_id=ctx['data']['group_id'], text=f" 提醒：{ctx['data']['text']}")
 
 
 @card.box()
@@ -88,33 +258,29 @@ async def _(ctx):
             pass
         else:
             # 1. 核心修复：将字典转为JSON字符串（避免[object Object]）
-            ark_data_str = json.dumps(ctx['ark_data'], ensure_ascii=False, indent=2)
-
-            # 2. 安全处理：限制消息长度（避免超长消息发送失败）
-            if len(ark_data_str) > 2000:
-                ark_data_str = ark_data_str[:2000] + "\n\n（内容过长，已截断）"
-
-            # 3. 发送格式化后的字符串（而非原始字典）
-            await card.send_msg(
-                group_id=message.group_id,
-                text=f"检测到卡片消息：\n{ark_data_str}"
-            )
-
-            # ========== 可选：解析快手视频链接（恢复你注释的逻辑） ==========
-            data_1 = ctx['ark_data']
-            # 防KeyError：逐层判断字段是否存在
-            if 'meta' in data_1 and 'news' in data_1['meta'] and 'jumpUrl' in data_1['meta']['news']:
-                url = data_1['meta']['news']['jumpUrl']
-                video_url = await extract_ks_video(url)
-                if video_url:
-                    # 发送视频（确保msg格式正确）
-                    await card._add_video(video_url)
-                    await card.send_msg(group_id=message.group_id)
-                    await card.send_msg(group_id=message.group_id, text='解析成功')
-            # ==============================================================
+            ark_data_str = await ctx['run_cpu'](json.dumps, ctx['ark_data'], ensure_ascii=False, indent=2)
+
+            # 2. 按行切成多个节点合并转发，超长内容也不截断
+            await card.send_group_forward_text(message.group_id, f"检测到卡片消息：\n{ark_data_str}")
     except Exception as e:
         # 异常捕获：避免单次卡片解析失败导致循环触发
         await card.send_msg(
             group_id=message.group_id,
             text=f"卡片消息处理出错：{str(e)}"
-        )
\ No newline at end of file
+        )
+
+@ks_card.box()
+async def _(ctx):
+    # 快手分享卡片：由 on_card 按跳转域名直接路由过来
+    url = ctx['fields']['meta.news.jumpUrl'] or ctx['jump_url']
+    # 解析出的直链带签名很快过期，缓存按分享链接记录；命中时连浏览器解析都省掉
+    video = media_cache.cached_path(url)
+    if not video:
+        video_url = await ks_video.extract_ks_video(url)
+        if video_url:
+            video = await media_cache.cached_file(video_url, key=url)
+    if video:
+        builder = Api()
+        await builder._add_video(video)
+        await builder.send_msg(group_id=message.group_id)
+        await ks_card.send_msg(group_id=message.group_id, text='解析成功')
\ No newline at end of file
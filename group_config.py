@@ -0,0 +1,88 @@
+import json
+import os
+from loguru import logger
+
+# ========== 全局变量 ==========
+CONFIG_FILE = os.path.join(os.getcwd(), "group_config.json")
+# 配置格式（处理器名称见 on_command(name=...)，未指定时为命令本身）：
+# {
+#     "default": {"disabled": ["卡片调试"]},            # 所有群默认关闭
+#     "groups": {
+#         "123456": {"disabled": ["豆包"], "enabled": ["卡片调试"]}
+#     }
+# }
+
+HANDLER_IDS = {}  # 处理器名称 -> 位序号（跨插件 reload 保持不变）
+_config = {"default": {"disabled": []}, "groups": {}}
+_default_mask = 0  # 未单独配置的群使用的禁用位图
+_group_masks = {}  # 群号 -> 禁用位图
+
+
+def handler_id(name: str) -> int:
+    """为处理器名称分配固定的位序号"""
+    hid = HANDLER_IDS.get(name)
+    if hid is None:
+        hid = HANDLER_IDS[name] = len(HANDLER_IDS)
+        _compile()  # 新名称可能已经出现在配置里
+    return hid
+
+
+def _mask(names) -> int:
+    mask = 0
+    for name in names:
+        if name in HANDLER_IDS:
+            mask |= 1 << HANDLER_IDS[name]
+    return mask
+
+
+def _compile():
+    """把配置编译成每个群一个整数位图，分发时只需一次字典查找和位运算"""
+    global _default_mask, _group_masks
+    _default_mask = _mask(_config.get("default", {}).get("disabled", []))
+    masks = {}
+    for group_id, rule in _config.get("groups", {}).items():
+        masks[int(group_id)] = (_default_mask | _mask(rule.get("disabled", []))) & ~_mask(rule.get("enabled", []))
+    _group_masks = masks
+
+
+def disabled_mask(group_id) -> int:
+    """群内被禁用的处理器位图，第 n 位为 1 表示 handler_id 为 n 的处理器关闭"""
+    return _group_masks.get(group_id, _default_mask)
+
+
+def load():
+    """重新读取配置文件（运行中可随时调用）"""
+    global _config
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, encoding="utf-8") as f:
+                _config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"读取群配置失败：{e}")
+            return
+    _config.setdefault("default", {}).setdefault("disabled", [])
+    _config.setdefault("groups", {})
+    _compile()
+    logger.info(f"已加载群配置：{len(_config['groups'])} 个群单独配置")
+
+
+def save():
+    tmp = f"{CONFIG_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_config, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, CONFIG_FILE)
+
+
+def set_enabled(group_id, name: str, enabled: bool):
+    """在某个群开启/关闭处理器，写回配置文件并立即生效"""
+    rule = _config["groups"].setdefault(str(group_id), {})
+    add, remove = ("enabled", "disabled") if enabled else ("disabled", "enabled")
+    if name in rule.get(remove, []):
+        rule[remove].remove(name)
+    if name not in rule.setdefault(add, []):
+        rule[add].append(name)
+    _compile()
+    save()
+
+
+load()
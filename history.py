@@ -0,0 +1,94 @@
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+# ========== 全局变量 ==========
+GROUP_CAPACITY = 200  # 每个群保留的最近消息数
+MAX_TOTAL_EVENTS = 20000  # 所有群加起来的上限，超过后淘汰最久不活跃的群
+
+
+class GroupHistory:
+    """
+    单个群的最近消息环形缓冲，按 message_id / message_seq 建索引，查找 O(1)
+    """
+    def __init__(self, capacity: int = GROUP_CAPACITY):
+        self.events = deque(maxlen=capacity)
+        self.by_id = {}
+        self.by_seq = {}
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, event: dict):
+        if len(self.events) == self.events.maxlen:
+            # 即将被挤出环形缓冲的旧消息，同步删掉索引
+            old = self.events[0]
+            self.by_id.pop(old.get("message_id"), None)
+            self.by_seq.pop(old.get("message_seq"), None)
+        self.events.append(event)
+        if event.get("message_id"):
+            self.by_id[event["message_id"]] = event
+        if event.get("message_seq"):
+            self.by_seq[event["message_seq"]] = event
+
+    def get(self, message_id) -> Optional[dict]:
+        return self.by_id.get(message_id) or self.by_id.get(_to_int(message_id))
+
+    def get_by_seq(self, message_seq) -> Optional[dict]:
+        return self.by_seq.get(message_seq) or self.by_seq.get(_to_int(message_seq))
+
+    def recent(self, n: int = 20) -> List[dict]:
+        """最近 n 条，按时间从旧到新"""
+        n = min(n, len(self.events))
+        return list(self.events)[-n:] if n else []
+
+
+def _to_int(value):
+    # 回复消息段里的 id 是字符串，事件里的是整数
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class HistoryStore:
+    """
+    所有群的消息缓冲：(self_id, group_id) -> GroupHistory，按最近活跃排序，总量超限时淘汰最久不活跃的群
+    """
+    def __init__(self, capacity: int = GROUP_CAPACITY, max_total: int = MAX_TOTAL_EVENTS):
+        self.capacity = capacity
+        self.max_total = max_total
+        self.groups: OrderedDict = OrderedDict()
+        self.total = 0
+
+    def add(self, event: dict):
+        group_id = event.get("group_id")
+        if not group_id:
+            return
+        key = (event.get("self_id", 0), group_id)
+        history = self.groups.get(key)
+        if history is None:
+            history = self.groups[key] = GroupHistory(self.capacity)
+        self.groups.move_to_end(key)
+        before = len(history)
+        history.add(event)
+        self.total += len(history) - before
+        while self.total > self.max_total and len(self.groups) > 1:
+            _, evicted = self.groups.popitem(last=False)
+            self.total -= len(evicted)
+
+    def group(self, self_id, group_id) -> Optional[GroupHistory]:
+        return self.groups.get((self_id, group_id))
+
+    def reply_target(self, event: dict) -> Optional[dict]:
+        """消息里回复的那条消息（不在缓冲里返回 None）"""
+        history = self.group(event.get("self_id", 0), event.get("group_id"))
+        if history is None:
+            return None
+        for seg in event.get("message") or []:
+            if isinstance(seg, dict) and seg.get("type") == "reply":
+                data = seg.get("data", {})
+                return history.get(data.get("id")) or history.get_by_seq(data.get("seq"))
+        return None
+
+
+history_store = HistoryStore()
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+# ========== 全局变量 ==========
+MAX_KEYS = 10000  # 单个限流器最多跟踪的用户/群数量，超过时淘汰最久未活跃的
+QUEUE_MAX_WAIT = 30  # queue 模式最多等待多久（秒），超时按丢弃处理
+
+# 限流器注册表：插件 reload 后处理器对象会重建，限流状态需要跨 reload 保留
+LIMITS = {}
+
+
+class SlidingWindow:
+    """
+    滑动窗口计数：每个 key 最多保存 limit 个时间戳，内存上限为 limit × max_keys
+    key 按最近访问排序，窗口内没有记录的 key 在访问时顺带清理
+    """
+    def __init__(self, limit: int, window: float, max_keys: int = MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.hits: OrderedDict = OrderedDict()  # key -> deque[时间戳]
+        self.notified = {}  # key -> 本窗口是否已提示过
+
+    def _sweep(self, now: float):
+        # 最久未访问的在最前面，过期了就删，遇到没过期的就停（均摊 O(1)）
+        while self.hits:
+            key, stamps = next(iter(self.hits.items()))
+            if len(self.hits) <= self.max_keys and stamps and stamps[-1] > now - self.window:
+                break
+            self.hits.popitem(last=False)
+            self.notified.pop(key, None)
+
+    def hit(self, key) -> bool:
+        """记录一次调用，超过限制返回 False（不计数）"""
+        now = time.monotonic()
+        self._sweep(now)
+        stamps = self.hits.get(key)
+        if stamps is None:
+            stamps = self.hits[key] = deque(maxlen=self.limit)
+        self.hits.move_to_end(key)
+        while stamps and stamps[0] <= now - self.window:
+            stamps.popleft()
+        if len(stamps) >= self.limit:
+            return False
+        stamps.append(now)
+        self.notified.pop(key, None)
+        return True
+
+    def retry_after(self, key) -> float:
+        """距离下一次可调用还有多少秒"""
+        stamps = self.hits.get(key)
+        if not stamps or len(stamps) < self.limit:
+            return 0
+        return max(0.0, stamps[0] + self.window - time.monotonic())
+
+    def notify_once(self, key) -> bool:
+        """同一个 key 在被限流期间只返回一次 True，用于只提示一次"""
+        if self.notified.get(key):
+            return False
+        self.notified[key] = True
+        return True
+
+
+class HandlerLimit:
+    """
+    处理器级限流：调用频率（按用户/群/全局）+ 最大并发
+    on_limit: drop → 静默丢弃；reply → 提示一次；queue → 等待额度（最多 QUEUE_MAX_WAIT 秒）
+    """
+    def __init__(self, rate: Optional[tuple] = None, per: str = "user", max_concurrent: Optional[int] = None,
+                 on_limit: str = "reply"):
+        self.config = (rate, per, max_concurrent, on_limit)
+        self.per = per
+        self.on_limit = on_limit
+        self.window = SlidingWindow(*rate) if rate else None
+        self.max_concurrent = max_concurrent
+        self.running = 0
+
+    def key(self, user_id, group_id):
+        if self.per == "group":
+            return group_id
+        if self.per == "global":
+            return None
+        return user_id
+
+    def _available(self) -> bool:
+        return not self.max_concurrent or self.running < self.max_concurrent
+
+    async def enter(self, user_id, group_id) -> bool:
+        """
+        尝试占用一次额度，成功返回 True，调用方结束后必须 leave()
+        """
+        key = self.key(user_id, group_id)
+        deadline = time.monotonic() + QUEUE_MAX_WAIT
+        while True:
+            if self._available() and (not self.window or self.window.hit(key)):
+                self.running += 1
+                return True
+            if self.on_limit != "queue" or time.monotonic() >= deadline:
+                return False
+            wait = self.window.retry_after(key) if self.window else 0
+            await asyncio.sleep(min(max(wait, 0.1), deadline - time.monotonic()))
+
+    def leave(self):
+        self.running -= 1
+
+    def check(self, user_id, group_id) -> bool:
+        """
+        只记一次调用频率、不占用并发（处理器不会执行时使用，如繁忙降级），超限返回 False
+        """
+        return not self.window or self.window.hit(self.key(user_id, group_id))
+
+    def should_reply(self, user_id, group_id) -> bool:
+        """被限流时是否需要回复提示（reply 模式下每个 key 只提示一次）"""
+        if self.on_limit != "reply":
+            return False
+        if not self.window:
+            return True
+        return self.window.notify_once(self.key(user_id, group_id))
+
+
+def get_limit(name: str, **config) -> HandlerLimit:
+    """
+    按名称获取限流器，配置不变时复用已有状态（跨插件 reload）
+    """
+    limit = LIMITS.get(name)
+    new = HandlerLimit(**config)
+    if limit is None or limit.config != new.config:
+        LIMITS[name] = limit = new
+    return limit
@@ -0,0 +1,136 @@
+import importlib
+import sys
+import time
+from contextlib import contextmanager
+from loguru import logger
+
+# ========== 全局变量 ==========
+IMPORT_TIMES = {}  # 模块名 -> (累计耗时, 自身耗时)，单位秒
+PHASE_TIMES = {}  # 启动阶段名 -> 耗时
+REPORT_TOP = 15  # 启动报告列出的模块数量
+
+_started_at = time.perf_counter()
+
+
+class _TimedLoader:
+    """
+    包装真实的 loader，只统计 exec_module 的耗时；执行完后把模块上的 loader 还原
+    """
+    def __init__(self, loader, timer: "_ImportTimer"):
+        self.loader = loader
+        self.timer = timer
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self.timer.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += total
+            IMPORT_TIMES[module.__name__] = (total, total - children)
+            module.__loader__ = self.loader
+            if module.__spec__ is not None:
+                module.__spec__.loader = self.loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class _ImportTimer:
+    """
+    放在 sys.meta_path 最前面，找到模块后替换成 _TimedLoader 计时
+    """
+    def __init__(self):
+        self.stack = []
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+
+_timer = _ImportTimer()
+
+
+def start_import_timer():
+    """开始统计导入耗时（需在其他模块导入之前调用）"""
+    if _timer not in sys.meta_path:
+        sys.meta_path.insert(0, _timer)
+
+
+def stop_import_timer():
+    if _timer in sys.meta_path:
+        sys.meta_path.remove(_timer)
+
+
+@contextmanager
+def phase(name: str):
+    """统计一个启动阶段的耗时：with loader.phase("连接"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_TIMES[name] = time.perf_counter() - start
+
+
+def startup_report() -> str:
+    """
+    启动耗时报告：总耗时、各阶段耗时、自身耗时最多的模块
+    """
+    stop_import_timer()
+    lines = [f"启动耗时 {time.perf_counter() - _started_at:.3f}s"]
+    for name, cost in PHASE_TIMES.items():
+        lines.append(f"  阶段 {name}: {cost * 1000:.1f}ms")
+    lines.append(f"导入耗时 Top {REPORT_TOP}（自身 / 累计）：")
+    ranked = sorted(IMPORT_TIMES.items(), key=lambda item: item[1][1], reverse=True)[:REPORT_TOP]
+    for name, (total, own) in ranked:
+        lines.append(f"  {name}: {own * 1000:.1f}ms / {total * 1000:.1f}ms")
+    return "\n".join(lines)
+
+
+# ========== 延迟导入 ==========
+class LazyModule:
+    """
+    模块代理：第一次访问属性时才真正导入，插件里很少用到的重依赖（playwright/markdown/requests）
+    不再拖慢启动和断线重启
+    """
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            name = self.__dict__["_name"]
+            first = name not in sys.modules
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            if first:
+                logger.info(f"首次加载插件 {name}，用时 {(time.perf_counter() - start) * 1000:.1f}ms")
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+
+def lazy_module(name: str) -> LazyModule:
+    """
+    ✅ md2img = lazy_module("plugin.md2img") → 用到 md2img.xxx 时才导入
+    """
+    return LazyModule(name)
@@ -1,36 +1,155 @@
-import websockets,json,asyncio,importlib,command
+import loader
+loader.start_import_timer()  # 统计启动时各模块的导入耗时
+import websockets,json,asyncio,importlib,random,time
 from loguru import logger
-from message import message
-import command,dic
+import command,dic,profiler,api,tracing
+from scheduler import scheduler
 
 # dic.py 只需在命令处理时 reload，避免启动时多余 reload
 ws_url = 'ws://127.0.0.1:3001'
 
+# 重连退避：第一次几乎立即重连，之后指数增长并加随机抖动
+RECONNECT_BASE = 0.2  # 首次重连等待（秒）
+RECONNECT_MAX = 60  # 重连等待上限（秒）
+# 心跳检测：超过 心跳间隔×倍数 没收到任何数据就认为连接已死，主动重连
+HEARTBEAT_MISS_FACTOR = 2.5
+# 断线补偿：重连后拉取活跃群的历史消息，经去重缓存后补处理断线期间的命令
+GAP_RECOVERY = True
+GAP_RECOVERY_COUNT = 20  # 每个群拉取条数
+ACTIVE_GROUP_TTL = 600  # 最近多少秒内有消息的群算活跃群
+
+META_PREFETCH = True  # 群变为活跃时后台预取成员列表
+
+# 多账号：每项对应一个 NapCat 实例（ws 事件地址 + http 动作地址），共享同一套处理器
+ACCOUNTS = [
+    {'ws_url': ws_url, 'api_url': api.api_url},
+]
+
+
+class BotConnection:
+    """
+    单个账号的连接：独立的 WebSocket、http 动作地址和 self_id
+    """
+    def __init__(self, ws_url: str, api_url: str):
+        self.ws_url = ws_url
+        self.api_url = api_url
+        self.self_id = 0  # 收到第一个事件后填充
+        self.heartbeat_interval = None  # 心跳间隔（秒），收到心跳事件后填充
+        self.active_groups = {}  # 群号 -> 最后一条消息时间
+        self.disconnected_at = None  # 上次断线时间
+        self.last_event_at = None  # 最后一次收到数据的时间（断线补偿从这里开始）
+        self.dispatcher = command.Dispatcher()
+
+    async def handle_message(self, data_1: dict):
+        self_id = data_1.get('self_id') or self.self_id
+        user_id = data_1.get('user_id')
+        self.self_id = self_id
+        if self_id == user_id:
+            return
+        group_id = data_1.get('group_id')
+        if group_id:
+            if META_PREFETCH and time.time() - self.active_groups.get(group_id, 0) > ACTIVE_GROUP_TTL:
+                command.spawn(api.meta_cache.prefetch([group_id]))
+            self.active_groups[group_id] = time.time()
+        # 每条消息一条追踪：从这里开始，随消息入队，分发协程处理完后结束
+        root = tracing.start('消息', self_id=self_id, group_id=group_id, user_id=user_id)
+        with tracing.use(root):
+            # 只在收到消息时 reload dic，减少循环依赖；先注销旧的处理器避免重复注册
+            with tracing.span('reload'):
+                command.clear_module_handlers(dic.__name__)
+                importlib.reload(dic)
+        # 入队后立即返回，接收循环不会被慢处理器阻塞
+        self.dispatcher.put(data_1, root)
+
+    async def recover_gap(self, since: float):
+        """
+        拉取活跃群的历史消息，断线期间的消息经去重缓存只处理一次
+        :param since: 最后一次收到数据的时间戳，只补处理这之后的消息
+        """
+        now = time.time()
+        groups = [g for g, t in self.active_groups.items() if now - t < ACTIVE_GROUP_TTL]
+        for group_id in groups:
+            try:
+                history = await api.api.get_group_msg_history(group_id, GAP_RECOVERY_COUNT)
+            except Exception as e:
+                logger.warning(f'拉取群{group_id}历史消息失败：{e}')
+                continue
+            missed = [m for m in history if m.get('time', 0) >= int(since)]
+            if missed:
+                logger.info(f'群{group_id}断线补偿：{len(missed)}条')
+            for data_1 in sorted(missed, key=lambda m: m.get('time', 0)):
+                data_1.setdefault('self_id', self.self_id)
+                await self.handle_message(data_1)
+
+    async def recv(self, ws):
+        # 知道心跳间隔后，超过若干个心跳周期没收到数据就判定连接已死
+        if self.heartbeat_interval:
+            return await asyncio.wait_for(ws.recv(), self.heartbeat_interval * HEARTBEAT_MISS_FACTOR)
+        return await ws.recv()
+
+    async def run(self):
+        # 本任务内的回复都发往该账号的 http 地址
+        api.current_api_url.set(self.api_url)
+        self.dispatcher.start()
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(uri=self.ws_url, close_timeout=1) as ws:
+                    logger.info(f'ws连接成功！{self.ws_url}')
+                    attempt = 0
+                    if GAP_RECOVERY and self.disconnected_at:
+                        # 静默断开时要等几个心跳周期才发现，从最后收到数据的时间补，而不是发现断线的时间
+                        command.spawn(self.recover_gap(self.last_event_at or self.disconnected_at))
+                    self.disconnected_at = None
+                    while True:
+                        try:
+                            data = await self.recv(ws)
+                            self.last_event_at = time.time()
+                            logger.info(f'{data}')
+                            if 'message_type' in data:
+                                await self.handle_message(json.loads(data))
+                            elif 'post_type' in data:
+                                event = json.loads(data)
+                                if event.get('meta_event_type') == 'heartbeat' and event.get('interval'):
+                                    self.heartbeat_interval = event['interval'] / 1000
+                                # 和消息一样交给分发队列，慢的事件处理器不会卡住接收循环；心跳太频繁，不记录追踪
+                                root = None
+                                if event.get('post_type') != 'meta_event':
+                                    root = tracing.start(f"事件 {event.get('post_type')}", group_id=event.get('group_id'))
+                                self.dispatcher.put(event, root)
+                        except websockets.exceptions.ConnectionClosed:
+                            logger.warning(f'连接断开！尝试重连...{self.ws_url}')
+                            break
+                        except asyncio.TimeoutError:
+                            logger.warning(f'心跳超时，连接可能已失效，主动重连...{self.ws_url}')
+                            break
+            except Exception as e:
+                logger.error(f'连接失败：{e}')
+            self.disconnected_at = self.disconnected_at or time.time()
+            delay = min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+            attempt += 1
+            logger.info(f'{delay:.1f}秒后重连（第{attempt}次）')
+            await asyncio.sleep(delay)
+
+
+class ConnectionManager:
+    """
+    在同一个事件循环里并发运行多个账号
+    """
+    def __init__(self, accounts: list):
+        self.connections = [BotConnection(**account) for account in accounts]
+
+    async def run(self):
+        # 每个连接是独立任务，各自持有 message/api 上下文
+        await asyncio.gather(*(conn.run() for conn in self.connections))
+
+
 async def ws_client():
-    while True:
-        try:
-            async with websockets.connect(uri=ws_url) as ws:
-                logger.info('ws连接成功！')
-                while True:
-                    try:
-                        data = await ws.recv()
-                        logger.info(f'{data}')
-                        if 'message_type' in data:
-                            data_1 = json.loads(data)
-                            self_id = data_1.get('self_id')
-                            user_id = data_1.get('user_id')
-                            if self_id == user_id:
-                                continue
-                            # 只在收到消息时 reload dic，减少循环依赖
-                            importlib.reload(dic)
-                            await message._set_message_data(data_1)
-                            await command.process_message()
-                    except websockets.exceptions.ConnectionClosed:
-                        logger.warning('连接断开！尝试重连...')
-                        break
-        except Exception as e:
-            logger.error(f'连接失败：{e}，5秒后重试')
-            await asyncio.sleep(5)
+    with loader.phase("信号/定时任务"):
+        profiler.install_signal_handlers()
+        scheduler.start()
+    logger.info(loader.startup_report())
+    await ConnectionManager(ACCOUNTS).run()
 
 if __name__ == '__main__':
     asyncio.run(ws_client())
\ No newline at end of file
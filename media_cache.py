@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Optional
+from urllib.parse import urlsplit
+from aiohttp import ClientSession, ClientTimeout
+from loguru import logger
+
+# ========== 全局变量 ==========
+ENABLED = True  # 关闭后直接发送原始链接
+CACHE_DIR = os.path.join(os.getcwd(), "cache", "media")
+MAX_BYTES = 2 * 1024 * 1024 * 1024  # 缓存总大小上限
+MAX_AGE = 7 * 24 * 3600  # 超过这么久没被使用的文件直接删除（秒）
+MAX_FILE_BYTES = 200 * 1024 * 1024  # 单个文件上限，超过放弃缓存
+# 单次下载超时（秒）：调用方处理器被取消时下载也会中断，
+# 所以要和解析耗时一起留在处理器超时以内（见 dic.py 快手解析）
+DOWNLOAD_TIMEOUT = 90
+CHUNK_SIZE = 64 * 1024
+WRITE_BATCH = 1024 * 1024  # 攒够这么多再交给线程写盘+算哈希，不在事件循环上做
+
+
+class MediaCache:
+    """
+    媒体文件本地缓存：
+    - 流式下载，边写边算 sha256，按内容命名，同一个视频只存一份
+    - key（默认为下载链接，也可以是分享链接）-> 文件名 的索引持久化在 index.json
+    - 同一个 key 并发请求只下载一次
+    - 按最后使用时间做 LRU，超过总大小或长期未使用的文件被清理
+    """
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.index = {}  # key -> 文件名
+        self.inflight = {}  # key -> Future
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            with open(self.index_file, encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.index = {}
+
+    def _save(self):
+        tmp = f"{self.index_file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_file)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """已缓存时返回本地路径，并刷新最后使用时间"""
+        self._load()
+        name = self.index.get(key)
+        if not name:
+            return None
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.exists(path):
+            self.index.pop(key, None)
+            return None
+        os.utime(path)
+        return path
+
+    async def fetch(self, url: str, key: Optional[str] = None) -> Optional[str]:
+        """
+        获取本地文件路径，没有缓存时下载
+        :param url: 下载链接
+        :param key: 缓存键，默认为 url；签名链接很快过期时可以传分享链接
+        :return: 本地路径（失败返回None）
+        """
+        key = key or url
+        path = self.lookup(key)
+        if path:
+            return path
+        future = self.inflight.get(key)
+        if future:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            path = await self._download(url)
+            if path:
+                self.index[key] = os.path.basename(path)
+                self._save()
+                self.evict()
+            future.set_result(path)
+            return path
+        except Exception as e:
+            logger.error(f"媒体缓存下载失败：{e}")
+            future.set_result(None)
+            return None
+        finally:
+            # 发起下载的处理器被取消时也要唤醒其他等待者，让它们退回原链接
+            if not future.done():
+                future.set_result(None)
+            self.inflight.pop(key, None)
+
+    async def _download(self, url: str) -> Optional[str]:
+        ext = os.path.splitext(urlsplit(url).path)[1][:8] or ".mp4"
+        tmp = os.path.join(self.cache_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+
+        def flush(f, chunks):
+            data = b"".join(chunks)
+            digest.update(data)
+            f.write(data)
+
+        try:
+            async with ClientSession(timeout=ClientTimeout(total=DOWNLOAD_TIMEOUT)) as session:
+                async with session.get(url) as resp:
+                    resp.raise_for_status()
+                    with open(tmp, "wb") as f:
+                        pending, pending_size = [], 0
+                        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                            size += len(chunk)
+                            if size > MAX_FILE_BYTES:
+                                logger.warning(f"文件超过 {MAX_FILE_BYTES} 字节，放弃缓存：{url}")
+                                return None
+                            pending.append(chunk)
+                            pending_size += len(chunk)
+                            if pending_size >= WRITE_BATCH:
+                                await asyncio.to_thread(flush, f, pending)
+                                pending, pending_size = [], 0
+                        if pending:
+                            await asyncio.to_thread(flush, f, pending)
+            path = os.path.join(self.cache_dir, digest.hexdigest() + ext)
+            if os.path.exists(path):
+                os.utime(path)  # 内容相同的文件已存在，直接复用
+            else:
+                os.replace(tmp, path)
+            logger.info(f"媒体已缓存：{path}（{size / 1024 / 1024:.1f} MiB）")
+            return path
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+        """删除长期未使用的文件，总大小超限时从最久未使用的开始删"""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name == "index.json" or entry.name.endswith((".part", ".tmp")):
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = set()
+        for mtime, size, path in files:
+            if total <= MAX_BYTES and now - mtime <= MAX_AGE:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed.add(os.path.basename(path))
+        if removed:
+            self.index = {k: v for k, v in self.index.items() if v not in removed}
+            self._save()
+            logger.info(f"媒体缓存清理 {len(removed)} 个文件")
+
+
+media_cache = MediaCache()
+
+
+async def cached_file(url: str, key: Optional[str] = None) -> str:
+    """
+    返回可以直接交给 Api._add_video/_add_image 的地址：缓存成功为 file://，否则为原链接
+    """
+    if not ENABLED:
+        return url
+    path = await media_cache.fetch(url, key)
+    return f"file://{path}" if path else url
+
+
+def cached_path(key: str) -> Optional[str]:
+    """
+    已缓存时直接返回 file:// 地址（可在解析链接之前调用，命中时省去整个解析过程）
+    """
+    if not ENABLED:
+        return None
+    path = media_cache.lookup(key)
+    return f"file://{path}" if path else None
@@ -1,3 +1,5 @@
+from contextvars import ContextVar
+
 class Message:
     """
     QQ消息对象，封装所有消息字段，支持异步数据填充。
@@ -53,4 +55,33 @@ class Message:
         self.group_name = data.get('group_name', '')
 
 
-message = Message()
\ No newline at end of file
+# 当前事件对应的消息对象：每个连接/任务各自持有，多账号并发时互不覆盖
+_current_message: ContextVar[Message] = ContextVar('current_message')
+
+
+class MessageProxy:
+    """
+    全局 message 的代理，属性读取转发到当前上下文中的 Message。
+    插件仍然使用 `from message import message`，无需关心是哪个账号收到的事件。
+    """
+    def _get(self) -> Message:
+        msg = _current_message.get(None)
+        if msg is None:
+            msg = Message()
+            _current_message.set(msg)
+        return msg
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    async def _set_message_data(self, data: dict|list) -> None:
+        """
+        为当前上下文创建新的 Message 并填充数据
+        :param data: 消息字典或列表
+        """
+        msg = Message()
+        await msg._set_message_data(data)
+        _current_message.set(msg)
+
+
+message = MessageProxy()
\ No newline at end of file
@@ -4,6 +4,7 @@ from typing import List, Dict, Optional
 from loguru import logger
 import asyncio  # 用于异步框架中调用同步代码
 import os
+import tracing
 
 class VolcArkMultiChat:
     """
@@ -121,11 +122,13 @@ class VolcArkMultiChat:
         """
         # 用asyncio执行同步函数，避免阻塞异步事件循环
         loop = asyncio.get_running_loop()
-        # 把同步的chat_sync放到线程池中执行
-        reply = await loop.run_in_executor(
-            None,  # 使用默认线程池
-            lambda: self.chat_sync(user_input)  # 调用同步方法
-        )
+        # 把同步的chat_sync放到线程池中执行（线程里拿不到 contextvar，span 记在这一层）
+        with tracing.span("豆包请求", model=self.model_id, chars=len(user_input)):
+            reply = await loop.run_in_executor(
+                None,  # 使用默认线程池
+                lambda: self.chat_sync(user_input)  # 调用同步方法
+            )
+            tracing.annotate(reply_chars=len(reply or ""))
         return reply
 
     def clear_context(self) -> None:
@@ -2,7 +2,9 @@ import asyncio
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 from loguru import logger
 from typing import Optional
+import tracing
 
+@tracing.traced("快手解析")
 async def extract_ks_video(url: str) -> Optional[str]:
     """
     异步提取快手视频链接
@@ -2,39 +2,84 @@ import markdown
 import os
 import re
 import asyncio
+import io
+import uuid
+from contextlib import asynccontextmanager
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 from loguru import logger
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from worker import run_cpu
+import tracing
 
-async def md_to_image_async(md_text: str, output_path: str = None) -> Optional[str]:
+try:
+    from PIL import Image  # 可选：用于 WebP 编码
+except ImportError:
+    Image = None
+
+# 临时图片目录：需要落盘时使用，按总大小清理最旧的文件
+TEMP_DIR = os.path.join(os.getcwd(), "tmp", "md_img")
+TEMP_DIR_MAX_BYTES = 200 * 1024 * 1024
+
+TILE_HEIGHT = 1600  # 长图分片高度（像素）
+
+# 页面尺寸和各顶层块的底部位置，用于在块边界切分
+_LAYOUT_JS = """() => {
+    const blocks = [...document.body.children].map(el => Math.ceil(el.getBoundingClientRect().bottom + window.scrollY));
+    const root = document.documentElement;
+    return {width: Math.ceil(root.scrollWidth), height: Math.ceil(root.scrollHeight), bottoms: blocks};
+}"""
+
+def cleanup_temp_dir(max_bytes: int = TEMP_DIR_MAX_BYTES) -> None:
     """
-    异步版 Markdown文本转图片（适配asyncio异步框架）
-    :param md_text: 要转换的Markdown文本
-    :param output_path: 图片保存路径（默认：当前目录/md_output.png）
-    :return: 图片路径（失败返回None）
+    临时目录超过 max_bytes 时从最旧的文件开始删除
     """
-    if not md_text:
-        logger.error("MD文本为空，无法转换")
-        return None
+    if not os.path.isdir(TEMP_DIR):
+        return
+    files = []
+    for entry in os.scandir(TEMP_DIR):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
 
-    # 1. 生成默认输出路径
-    if not output_path:
-        output_path = os.path.join(os.getcwd(), "md_output.png")
+def encode_image(png: bytes, image_format: str, quality: int) -> bytes:
+    """
+    PNG 转其他格式（在进程池中执行），没有安装 Pillow 时原样返回
+    """
+    if Image is None:
+        return png
+    with Image.open(io.BytesIO(png)) as img:
+        out = io.BytesIO()
+        img.convert("RGB").save(out, format=image_format.upper(), quality=quality)
+        return out.getvalue()
 
-    try:
-        # 2. MD转HTML + 修复删除线
-        html_content = markdown.markdown(
-            md_text,
-            extensions=[
-                'markdown.extensions.extra',
-                'markdown.extensions.fenced_code'
-            ]
-        )
-        # 手动替换~~文本~~为<del>文本</del>
-        html_content = re.sub(r'~~(.*?)~~', r'<del>\1</del>', html_content)
-
-        # 3. 构造完整HTML模板
-        html = f"""
+def render_markdown(md_text: str) -> str:
+    """
+    MD转HTML + 修复删除线（纯CPU计算，在进程池中执行）
+    """
+    html_content = markdown.markdown(
+        md_text,
+        extensions=[
+            'markdown.extensions.extra',
+            'markdown.extensions.fenced_code'
+        ]
+    )
+    # 手动替换~~文本~~为<del>文本</del>
+    return re.sub(r'~~(.*?)~~', r'<del>\1</del>', html_content)
+
+def build_html(html_content: str) -> str:
+    """
+    构造完整HTML模板
+    """
+    return f"""
         <!DOCTYPE html>
         <html lang="zh-CN">
         <head>
@@ -122,32 +167,86 @@ async def md_to_image_async(md_text: str, output_path: str = None) -> Optional[s
         </html>
         """
 
-        # 4. Playwright异步API渲染截图（核心修改）
-        async with async_playwright() as p:
+@asynccontextmanager
+async def _render_page(md_text: str):
+    """
+    渲染 Markdown 并返回加载完成的页面，退出时关闭浏览器
+    """
+    # MD转HTML + 修复删除线（放进程池，避免长文本阻塞事件循环）
+    with tracing.span("markdown", chars=len(md_text)):
+        html = build_html(await run_cpu(render_markdown, md_text))
+
+    async with async_playwright() as p:
+        with tracing.span("启动浏览器"):
             browser = await p.chromium.launch(
                 headless=True,
                 args=["--no-sandbox", "--disable-gpu"]
             )
-            page = await browser.new_page(
-                viewport={"width": 900, "height": 1300},
-                extra_http_headers={"Accept-Language": "zh-CN"}
-            )
-            page.set_default_timeout(10000)
+        try:
+            with tracing.span("页面加载"):
+                page = await browser.new_page(
+                    viewport={"width": 900, "height": 1300},
+                    extra_http_headers={"Accept-Language": "zh-CN"}
+                )
+                page.set_default_timeout(10000)
 
-            await page.set_content(html, wait_until="load")
-            await asyncio.sleep(2)  # 异步等待CDN加载（替换time.sleep）
-            await page.wait_for_load_state("networkidle")
+                await page.set_content(html, wait_until="load")
+                await asyncio.sleep(2)  # 异步等待CDN加载（替换time.sleep）
+                await page.wait_for_load_state("networkidle")
+            yield page
+        finally:
+            await browser.close()
 
-            # 异步截图保存
-            await page.screenshot(
-                path=output_path,
-                full_page=True,
-                type="png"
-            )
+def _image_format(image_format: str) -> str:
+    image_format = image_format.lower().replace("jpg", "jpeg")
+    if image_format == "webp" and Image is None:
+        return "png"
+    return image_format
 
-            await page.close()
-            await browser.close()
+@tracing.traced("md2img")
+async def md_to_image_async(md_text: str, output_path: str = None, as_bytes: bool = False,
+                            image_format: str = "png", quality: int = 80) -> Optional[Union[str, bytes]]:
+    """
+    异步版 Markdown文本转图片（适配asyncio异步框架）
+    :param md_text: 要转换的Markdown文本
+    :param output_path: 图片保存路径（默认：临时目录下随机文件名）
+    :param as_bytes: True 时不落盘，直接返回编码后的图片数据（配合 Api._add_image_bytes）
+    :param image_format: png|jpeg|webp（webp 需要 Pillow，否则退回 png）
+    :param quality: jpeg/webp 质量
+    :return: 图片路径或图片数据（失败返回None）
+    """
+    if not md_text:
+        logger.error("MD文本为空，无法转换")
+        return None
 
+    image_format = _image_format(image_format)
+
+    # 1. 生成默认输出路径（随机文件名，并发渲染互不覆盖）
+    if not output_path and not as_bytes:
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        cleanup_temp_dir()
+        output_path = os.path.join(TEMP_DIR, f"{uuid.uuid4().hex}.{image_format}")
+
+    try:
+        # 2. 渲染并截图（浏览器只支持 png/jpeg，webp 截 png 后再转码）
+        async with _render_page(md_text) as page:
+            shot_type = "jpeg" if image_format == "jpeg" else "png"
+            with tracing.span("截图"):
+                data = await page.screenshot(
+                    full_page=True,
+                    type=shot_type,
+                    quality=quality if shot_type == "jpeg" else None
+                )
+
+        if image_format == "webp":
+            data = await run_cpu(encode_image, data, image_format, quality)
+
+        if as_bytes:
+            logger.info(f"MD转图片成功，{image_format} {len(data) / 1024:.1f} KiB")
+            return data
+
+        with open(output_path, "wb") as f:
+            f.write(data)
         logger.info(f"MD转图片成功，保存路径：{output_path}")
         return output_path
 
@@ -158,6 +257,64 @@ async def md_to_image_async(md_text: str, output_path: str = None) -> Optional[s
         logger.error(f"MD转图片失败：{str(e)}")
         return None
 
+def split_tiles(bottoms: List[int], height: int, tile_height: int = TILE_HEIGHT) -> List[Tuple[int, int]]:
+    """
+    按块边界把页面切成不超过 tile_height 的区间，单个块比分片还高时只能硬切
+    :param bottoms: 各块底部的纵坐标
+    :param height: 页面总高度
+    :return: [(top, bottom), ...]
+    """
+    tiles = []
+    start = last = 0
+    for bottom in sorted({min(b, height) for b in bottoms}) + [height]:
+        while bottom - start > tile_height:
+            cut = last if last > start else start + tile_height
+            tiles.append((start, cut))
+            start = cut
+        last = bottom
+    if height > start:
+        tiles.append((start, height))
+    return tiles
+
+async def md_to_image_tiles(md_text: str, tile_height: int = TILE_HEIGHT, image_format: str = "jpeg",
+                            quality: int = 80) -> AsyncIterator[bytes]:
+    """
+    长图分片：按块边界切成多张图，逐张截图编码后 yield，峰值内存只和单张分片有关
+    :param md_text: 要转换的Markdown文本
+    :param tile_height: 每张分片最大高度（像素）
+    :param image_format: png|jpeg|webp
+    :param quality: jpeg/webp 质量
+    :return: 异步迭代的图片数据（失败时提前结束）
+    """
+    if not md_text:
+        logger.error("MD文本为空，无法转换")
+        return
+
+    image_format = _image_format(image_format)
+    shot_type = "jpeg" if image_format == "jpeg" else "png"
+    try:
+        async with _render_page(md_text) as page:
+            layout = await page.evaluate(_LAYOUT_JS)
+            tiles = split_tiles(layout["bottoms"], layout["height"], tile_height)
+            logger.info(f"MD转图片：高度 {layout['height']}px，分 {len(tiles)} 张")
+            for top, bottom in tiles:
+                # span 不跨 yield，否则调用方发送消息的耗时会被算进截图里
+                with tracing.span("截图", top=top, height=bottom - top):
+                    data = await page.screenshot(
+                        full_page=True,
+                        clip={"x": 0, "y": top, "width": layout["width"], "height": bottom - top},
+                        type=shot_type,
+                        quality=quality if shot_type == "jpeg" else None
+                    )
+                    if image_format == "webp":
+                        data = await run_cpu(encode_image, data, image_format, quality)
+                yield data
+
+    except PlaywrightTimeoutError:
+        logger.error("CDN加载超时，建议使用离线版Prism.js")
+    except Exception as e:
+        logger.error(f"MD转图片失败：{str(e)}")
+
 # 同步兼容接口（保留，供非异步场景测试）
 def md_to_image(md_text: str, output_path: str = None) -> Optional[str]:
     """
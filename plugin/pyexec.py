@@ -0,0 +1,131 @@
+import asyncio
+import codecs
+import itertools
+import signal
+import sys
+from typing import AsyncIterator, Dict, Optional
+from loguru import logger
+
+try:
+    import resource  # 仅 POSIX，Windows 下不做 CPU/内存限制
+except ImportError:
+    resource = None
+
+# ========== 全局变量 ==========
+EXEC_TIMEOUT = 60  # 墙钟超时（秒）
+EXEC_CPU_SECONDS = 30  # CPU 时间上限（秒）
+EXEC_MEMORY_MB = 512  # 地址空间上限（MB）
+MAX_OUTPUT = 100000  # 输出上限（字符），超过后终止任务
+
+# 子进程入口：从 stdin 读取代码执行，-u 保证输出不缓冲、可以边跑边读
+_BOOTSTRAP = "import sys; exec(compile(sys.stdin.read(), '<执行>', 'exec'), {'__name__': '__main__'})"
+
+JOBS: Dict[int, "ExecJob"] = {}  # 运行中的任务
+_ids = itertools.count(1)
+
+
+class ExecJob:
+    """
+    在独立子进程中执行一段代码：stdout/stderr 合并按顺序捕获，可边执行边读取，可随时终止
+    """
+    def __init__(self, code: str, timeout: float = EXEC_TIMEOUT, cpu_seconds: int = EXEC_CPU_SECONDS,
+                 memory_mb: int = EXEC_MEMORY_MB):
+        self.id = next(_ids)
+        self.code = code
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.cancelled = False
+
+    def _limits(self):
+        # 在子进程 exec 之前执行；软限制比硬限制少 1 秒，先收到 SIGXCPU，能报告终止原因
+        resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 1))
+        memory = self.memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", "-I", "-c", _BOOTSTRAP,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            preexec_fn=self._limits if resource else None
+        )
+        JOBS[self.id] = self
+        self.proc.stdin.write(self.code.encode("utf-8"))
+        await self.proc.stdin.drain()
+        self.proc.stdin.close()
+        logger.info(f"执行任务{self.id}已启动，pid={self.proc.pid}")
+
+    async def stream(self) -> AsyncIterator[str]:
+        """
+        逐段输出执行结果，结束时附带退出状态
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        size = 0
+        stopped = False  # 超时/超长被终止时不再重复输出退出码
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self.kill()
+                    stopped = True
+                    yield f"\n[超过{self.timeout}秒，已终止]"
+                    break
+                try:
+                    data = await asyncio.wait_for(self.proc.stdout.read(4096), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                if not data:
+                    break
+                text = decoder.decode(data)
+                size += len(text)
+                yield text
+                if size > MAX_OUTPUT:
+                    self.kill()
+                    stopped = True
+                    yield f"\n[输出超过{MAX_OUTPUT}字符，已终止]"
+                    break
+            code = await self.proc.wait()
+            if self.cancelled:
+                yield "\n[已被手动终止]"
+            elif code and not stopped:
+                yield f"\n[{_exit_reason(code, self.cpu_seconds)}]"
+        finally:
+            self.kill()
+            JOBS.pop(self.id, None)
+
+    def kill(self):
+        if self.proc and self.proc.returncode is None:
+            self.proc.kill()
+
+    def cancel(self):
+        self.cancelled = True
+        self.kill()
+
+
+def _exit_reason(code: int, cpu_seconds: int) -> str:
+    """把退出码翻译成提示，负数表示被信号终止"""
+    if code > 0:
+        return f"退出码 {code}"
+    if code == -getattr(signal, "SIGXCPU", 0):
+        return f"CPU 时间超过{cpu_seconds}秒，已终止"
+    if code == -getattr(signal, "SIGKILL", 0):
+        # 忽略 SIGXCPU 后到达硬限制，或被系统因内存不足杀掉
+        return "被强制终止（CPU 时间或内存超限）"
+    try:
+        return f"被信号 {signal.Signals(-code).name} 终止"
+    except ValueError:
+        return f"退出码 {code}"
+
+
+def cancel(job_id: int) -> bool:
+    """终止指定任务"""
+    job = JOBS.get(job_id)
+    if not job:
+        return False
+    job.cancel()
+    return True
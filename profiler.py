@@ -0,0 +1,139 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import time
+import tracemalloc
+from typing import Optional
+from loguru import logger
+
+# ========== 全局变量 ==========
+PROFILE_DIR = os.path.join(os.getcwd(), "profile")  # 报告输出目录
+MAX_PROFILE_SECONDS = 120  # 单次采集时长上限，防止误操作长时间拖慢机器人
+TRACEMALLOC_FRAMES = 10  # tracemalloc 记录的调用栈深度
+
+_profiling = False  # 同一时间只允许一个 cProfile 采集
+_baseline: Optional[tracemalloc.Snapshot] = None  # 内存快照基线
+_signal_tasks = set()  # 信号触发的采集任务（持有引用，防止被垃圾回收）
+
+
+def write_report(name: str, text: str) -> str:
+    """把报告写入 profile 目录，返回文件路径"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+# ========== CPU 采集 ==========
+async def profile_loop(seconds: float = 10, top: int = 30, sort: str = "cumulative") -> str:
+    """
+    在事件循环线程上开启 cProfile，采集 seconds 秒内所有回调的耗时
+    :param seconds: 采集时长（秒），超过 MAX_PROFILE_SECONDS 会被截断
+    :param top: 输出前多少个热点函数
+    :param sort: pstats 排序字段 cumulative|tottime|ncalls
+    :return: 文本报告
+    """
+    global _profiling
+    if _profiling:
+        raise RuntimeError("已有性能采集正在进行")
+    seconds = max(1.0, min(float(seconds), MAX_PROFILE_SECONDS))
+    _profiling = True
+    profile = cProfile.Profile()
+    try:
+        # 采集期间本协程挂起，事件循环上的其他任务照常运行并被记录
+        profile.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+        _profiling = False
+
+    out = io.StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+    return f"cProfile 采集 {seconds:.0f} 秒，按 {sort} 排序：\n{out.getvalue()}"
+
+
+# ========== 内存快照 ==========
+def memory_baseline() -> str:
+    """开启 tracemalloc 并记录当前快照作为基线"""
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    _baseline = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    return f"已记录内存基线：当前 {current / 1024:.1f} KiB，峰值 {peak / 1024:.1f} KiB"
+
+
+def memory_diff(top: int = 20) -> str:
+    """
+    与基线对比，输出增长最多的分配位置以及框架内关键容器的大小
+    :param top: 输出前多少条
+    :return: 文本报告
+    """
+    if not tracemalloc.is_tracing() or _baseline is None:
+        return memory_baseline() + "\n（此前没有基线，请稍后再次执行对比）"
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    lines = [f"内存增长 Top {top}（对比基线）："]
+    for stat in snapshot.compare_to(_baseline, "lineno")[:top]:
+        lines.append(str(stat))
+
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append(f"\n当前 {current / 1024:.1f} KiB，峰值 {peak / 1024:.1f} KiB")
+    lines.append("关键容器：")
+    for name, size in container_sizes().items():
+        lines.append(f"  {name}: {size}")
+    return "\n".join(lines)
+
+
+def container_sizes() -> dict:
+    """统计框架内常见的会增长的容器大小（模块未加载时跳过）"""
+    sizes = {}
+    command = sys.modules.get("command")
+    if command:
+        sizes["HANDLERS.global"] = len(command.HANDLERS["global"])
+        sizes["HANDLERS.command"] = len(command.HANDLERS["command"])
+        sizes["HANDLERS.regex"] = len(command.HANDLERS["regex"])
+        sizes["PROCESSED_MSG_IDS"] = len(command.PROCESSED_MSG_IDS)
+    chat = sys.modules.get("plugin.chat")
+    if chat:
+        sizes["chat_instances"] = len(chat.chat_manager.chat_instances)
+    return sizes
+
+
+# ========== 信号触发（仅 POSIX） ==========
+def install_signal_handlers(seconds: float = 10) -> None:
+    """
+    注册信号：SIGUSR1 → 采集 cProfile，SIGUSR2 → 内存快照对比
+    报告写入 PROFILE_DIR；Windows 下没有这两个信号，直接跳过
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    loop = asyncio.get_running_loop()
+
+    async def _profile_to_file():
+        try:
+            path = write_report("cprofile", await profile_loop(seconds))
+            logger.info(f"性能采集完成：{path}")
+        except RuntimeError as e:
+            logger.warning(str(e))
+
+    def _memory_to_file():
+        path = write_report("memory", memory_diff())
+        logger.info(f"内存快照完成：{path}")
+
+    def _start_profile():
+        task = loop.create_task(_profile_to_file())
+        _signal_tasks.add(task)
+        task.add_done_callback(_signal_tasks.discard)
+
+    loop.add_signal_handler(signal.SIGUSR1, _start_profile)
+    loop.add_signal_handler(signal.SIGUSR2, _memory_to_file)
@@ -0,0 +1,323 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+from loguru import logger
+from api import Api, current_api_url
+from worker import run_cpu
+
+# ========== 全局变量 ==========
+JOBS_FILE = os.path.join(os.getcwd(), "schedule_jobs.json")  # 一次性任务持久化文件
+SAVE_DELAY = 1  # 持久化合并写入的延迟（秒），大量任务同时变动时只写一次
+DEFAULT_MISFIRE_GRACE = 60  # 允许的延迟（秒），超过则按 misfire 策略处理
+
+# 任务目标：名称 -> ScheduleHandler（reload 插件时按名称覆盖，已排期的任务自动使用新函数）
+SCHEDULE_TARGETS = {}
+
+
+# ========== cron 表达式 ==========
+class Cron:
+    """
+    简易 cron：分 时 日 月 周，支持 * */n a-b a,b 写法，周 0=周日
+    """
+    RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式需要5段：{expr}")
+        self.expr = expr
+        self.minute, self.hour, self.day, self.month, self.weekday = (
+            self._parse(f, lo, hi) for f, (lo, hi) in zip(fields, self.RANGES)
+        )
+        # 日和周都被限制时按 cron 惯例取并集
+        self.day_or_weekday = fields[2] != "*" and fields[4] != "*"
+
+    @staticmethod
+    def _parse(field: str, lo: int, hi: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/")
+                step = int(step)
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start, end = (int(x) for x in part.split("-"))
+            else:
+                start = end = int(part)
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_match(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.day
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekday
+        return (day_ok or weekday_ok) if self.day_or_weekday else (day_ok and weekday_ok)
+
+    def next_after(self, ts: float) -> float:
+        """返回 ts 之后第一个匹配的时间戳（按本地时间）"""
+        dt = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        # 不匹配的字段直接跳到下一个单位的开头，而不是逐分钟尝试
+        while dt < limit:
+            if dt.month not in self.month:
+                dt = (dt.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_match(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hour:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minute:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError(f"cron 表达式没有可执行时间：{self.expr}")
+
+
+# ========== 任务 ==========
+class Job:
+    def __init__(self, name: str, run_at: float, interval: Optional[float] = None, cron: Optional[Cron] = None,
+                 jitter: float = 0, misfire: str = "run_once", misfire_grace: float = DEFAULT_MISFIRE_GRACE,
+                 data: Optional[dict] = None, job_id: Optional[str] = None, api_url: Optional[str] = None):
+        self.id = job_id or str(uuid.uuid4())
+        self.name = name
+        self.run_at = run_at
+        self.interval = interval
+        self.cron = cron
+        self.jitter = jitter
+        self.misfire = misfire
+        self.misfire_grace = misfire_grace
+        self.data = data or {}
+        self.api_url = api_url  # 添加任务时所在账号，执行时回复走同一账号
+        self.cancelled = False
+
+    @property
+    def one_shot(self) -> bool:
+        return self.interval is None and self.cron is None
+
+    def next_run(self, now: float) -> float:
+        """计算下一次执行时间；错过的周期合并为一次，不会补跑"""
+        if self.cron:
+            next_at = self.cron.next_after(now)
+        else:
+            missed = max(1, int((now - self.run_at) // self.interval) + 1)
+            next_at = self.run_at + missed * self.interval
+        return next_at + random.uniform(0, self.jitter)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "run_at": self.run_at, "misfire": self.misfire,
+                "misfire_grace": self.misfire_grace, "data": self.data, "api_url": self.api_url}
+
+
+class Scheduler:
+    """
+    单个定时器堆驱动所有任务：只有一个后台协程，任务再多也不会每个任务一个 task
+    - 取消任务只打标记，出堆时丢弃（惰性删除）
+    - 一次性任务持久化到 JOBS_FILE，重启后恢复
+    """
+    def __init__(self, jobs_file: str = JOBS_FILE):
+        self.jobs_file = jobs_file
+        self.heap = []
+        self.jobs = {}  # 任务ID -> Job
+        self._seq = itertools.count()  # 同一时间的任务按加入顺序执行
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running = set()  # 执行中的任务（持有引用，防止被垃圾回收）
+        self._save_handle = None
+
+    # ----- 增删任务 -----
+    def _push(self, job: Job) -> Job:
+        self.jobs[job.id] = job
+        heapq.heappush(self.heap, (job.run_at, next(self._seq), job))
+        # 新任务比当前等待的更早时唤醒后台协程
+        if self._wakeup and self.heap[0][2] is job:
+            self._wakeup.set()
+        if job.one_shot:
+            self._schedule_save()
+        return job
+
+    def add_interval(self, name: str, seconds: float, jitter: float = 0, **kwargs) -> Job:
+        run_at = time.time() + seconds + random.uniform(0, jitter)
+        return self._push(Job(name, run_at, interval=seconds, jitter=jitter, **kwargs))
+
+    def add_cron(self, name: str, expr: str, jitter: float = 0, **kwargs) -> Job:
+        cron = Cron(expr)
+        run_at = cron.next_after(time.time()) + random.uniform(0, jitter)
+        return self._push(Job(name, run_at, cron=cron, jitter=jitter, **kwargs))
+
+    def add_once(self, name: str, delay: Optional[float] = None, run_at: Optional[float] = None,
+                 data: Optional[dict] = None, **kwargs) -> Job:
+        """
+        添加一次性任务（会持久化）
+        :param name: on_schedule 注册的任务名
+        :param delay: 多少秒后执行（与 run_at 二选一）
+        :param run_at: 执行时间戳
+        :param data: 传给处理器的数据，需能 JSON 序列化
+        """
+        if run_at is None:
+            run_at = time.time() + (delay or 0)
+        kwargs.setdefault("api_url", current_api_url.get())
+        return self._push(Job(name, run_at, data=data, **kwargs))
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.pop(job_id, None)
+        if not job:
+            return False
+        job.cancelled = True
+        if job.one_shot:
+            self._schedule_save()
+        return True
+
+    # ----- 持久化 -----
+    def _schedule_save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self._save_handle is None:
+            self._save_handle = loop.call_later(SAVE_DELAY, self.save)
+
+    def save(self):
+        self._save_handle = None
+        jobs = [job.to_dict() for job in self.jobs.values() if job.one_shot]
+        tmp = f"{self.jobs_file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, ensure_ascii=False)
+        os.replace(tmp, self.jobs_file)
+
+    def load(self):
+        if not os.path.exists(self.jobs_file):
+            return
+        try:
+            with open(self.jobs_file, encoding="utf-8") as f:
+                jobs = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"读取定时任务失败：{e}")
+            return
+        for item in jobs:
+            job_id = item.pop("id")
+            if job_id not in self.jobs:
+                self._push(Job(job_id=job_id, **item))
+        logger.info(f"已恢复 {len(jobs)} 个一次性定时任务")
+
+    # ----- 执行 -----
+    def start(self):
+        """在当前事件循环启动后台协程（重复调用无效）"""
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self.load()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            # 丢弃已取消的任务
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            if timeout is None or timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, job = heapq.heappop(self.heap)
+            now = time.time()
+            late = now - job.run_at
+            if late <= job.misfire_grace or job.misfire == "run_once":
+                # 计划时间要在这里传进去，下面会立即把 job.run_at 改成下一次
+                task = asyncio.create_task(self._fire(job, job.run_at))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            else:
+                logger.warning(f"定时任务 {job.name} 延迟 {late:.0f} 秒，按策略跳过")
+
+            if job.one_shot:
+                self.jobs.pop(job.id, None)
+                self._schedule_save()
+            else:
+                job.run_at = job.next_run(now)
+                heapq.heappush(self.heap, (job.run_at, next(self._seq), job))
+
+    async def _fire(self, job: Job, scheduled_time: float):
+        target = SCHEDULE_TARGETS.get(job.name)
+        if target is None:
+            logger.warning(f"定时任务 {job.name} 没有对应的处理器")
+            return
+        if job.api_url:
+            current_api_url.set(job.api_url)
+        await target.wrapped(job, scheduled_time)
+
+
+scheduler = Scheduler()
+
+
+# ========== 注册接口 ==========
+class ScheduleHandler(Api):
+    def __init__(self, name: str, interval: Optional[float] = None, cron: Optional[str] = None,
+                 jitter: float = 0, misfire: str = "run_once", misfire_grace: float = DEFAULT_MISFIRE_GRACE):
+        """
+        定时任务处理器：
+        - interval → 每隔 interval 秒执行
+        - cron → 按 cron 表达式执行
+        - 都不传 → 只注册任务名，配合 scheduler.add_once 做一次性任务（如提醒）
+        - misfire: run_once → 延迟过久也补跑一次；skip → 超过 misfire_grace 就跳过
+        """
+        super().__init__()
+        self.name = name
+        self.interval = interval
+        self.cron = cron
+        self.options = {"jitter": jitter, "misfire": misfire, "misfire_grace": misfire_grace}
+        self.func = None
+        self.wrapped = None
+
+    def box(self):
+        def decorator(func):
+            self.func = func
+            self.wrapped = self._wrap_handler(func)
+            # 同名任务已在运行（插件 reload）时只替换函数，不重复排期
+            first = self.name not in SCHEDULE_TARGETS
+            SCHEDULE_TARGETS[self.name] = self
+            if first and self.interval:
+                scheduler.add_interval(self.name, self.interval, **self.options)
+            elif first and self.cron:
+                scheduler.add_cron(self.name, self.cron, **self.options)
+            return func
+
+        return decorator
+
+    def _wrap_handler(self, func):
+        @functools.wraps(func)
+        async def wrapper(job: Job, scheduled_time: Optional[float] = None):
+            try:
+                ctx = {
+                    "job_id": job.id,  # 任务ID
+                    "name": job.name,  # 任务名
+                    "data": job.data,  # add_once 传入的数据
+                    "scheduled_time": job.run_at if scheduled_time is None else scheduled_time,  # 本次计划执行时间
+                    "run_cpu": run_cpu
+                }
+                await func(ctx)
+            except Exception as e:
+                logger.error(f"定时任务 {job.name} 执行出错: {e}")
+
+        return wrapper
+
+
+def on_schedule(name: str, interval: Optional[float] = None, cron: Optional[str] = None, **options):
+    """
+    ✅ on_schedule("清理缓存", interval=3600) → 每小时执行
+    ✅ on_schedule("日报", cron="0 9 * * *") → 每天9点执行
+    ✅ on_schedule("提醒") → 一次性任务目标，scheduler.add_once("提醒", delay=60, data={...})
+    """
+    return ScheduleHandler(name, interval=interval, cron=cron, **options)
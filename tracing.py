@@ -0,0 +1,252 @@
+import asyncio
+import functools
+import itertools
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+from loguru import logger
+
+# ========== 全局变量 ==========
+ENABLED = True  # 关闭后 start/span 都不做任何记录
+TRACE_FILE = os.path.join(os.getcwd(), "trace", "traces.jsonl")  # 每条追踪一行 JSON
+TRACE_FILE_MAX_BYTES = 20 * 1024 * 1024  # 超过后轮转为 traces.jsonl.1
+EXPORT_MIN_MS = 300  # 总耗时低于该值的追踪不写文件（内存里照常保留），正常的快消息不产生磁盘写入
+EXPORT_FLUSH_INTERVAL = 2  # 待写入的追踪攒这么久（秒）后在线程里一次写盘
+RECENT_TRACES = 500  # 内存中保留最近多少条追踪，供「追踪」指令查看
+MAX_SPANS = 200  # 单条追踪最多记录的 span 数，防止循环里打点撑爆内存
+
+RECENT = deque(maxlen=RECENT_TRACES)
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+_pending_lines = []  # 等待写入文件的追踪
+_flush_handle = None
+
+
+class Trace:
+    """
+    一次事件（一条消息/一个通知）从收到到处理完的全部 span
+    """
+    def __init__(self):
+        self.id = f"{int(time.time()):x}-{next(_ids)}"
+        self.started_at = time.time()
+        self.spans: List["Span"] = []
+        self.finished = False
+
+    @property
+    def root(self) -> "Span":
+        return self.spans[0]
+
+    def to_dict(self) -> dict:
+        base = self.root.start
+        return {
+            "trace_id": self.id,
+            "time": self.started_at,
+            "duration_ms": self.root.duration_ms,
+            "spans": [span.to_dict(base) for span in self.spans]
+        }
+
+
+class Span:
+    __slots__ = ("trace", "index", "parent", "name", "depth", "attrs", "start", "end", "error")
+
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"], attrs: dict):
+        self.trace = trace
+        self.index = len(trace.spans)
+        self.parent = parent.index if parent else None  # 父 span 在 trace.spans 中的序号
+        self.name = name
+        self.depth = parent.depth + 1 if parent else 0
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+        trace.spans.append(self)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end is None else (self.end - self.start) * 1000
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, base: float) -> dict:
+        data = {
+            "name": self.name,
+            "parent": self.parent,
+            "offset_ms": round((self.start - base) * 1000, 2),
+            "duration_ms": None if self.end is None else round(self.duration_ms, 2)
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+# ========== 创建/结束 ==========
+def start(name: str, **attrs) -> Optional[Span]:
+    """
+    开始一条新追踪，返回根 span（此时还不是当前 span，用 use() 激活）
+    根 span 可以跟着消息一起入队，在分发协程里继续使用
+    """
+    if not ENABLED:
+        return None
+    return Span(Trace(), name, None, attrs)
+
+
+def finish(root: Optional[Span], **attrs):
+    """结束追踪：记录到内存并写入文件"""
+    if root is None or root.trace.finished:
+        return
+    root.set(**attrs)
+    root.end = time.perf_counter()
+    root.trace.finished = True
+    RECENT.append(root.trace)
+    if root.duration_ms >= EXPORT_MIN_MS:
+        _export(root.trace)
+
+
+@contextmanager
+def use(span: Optional[Span]):
+    """把 span 设为当前 span（跨队列/跨任务传递追踪时使用）"""
+    token = _current.set(span)
+    try:
+        yield span
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    """
+    ✅ with tracing.trace("事件"): ... → 开始一条追踪并在退出时结束
+    """
+    root = start(name, **attrs)
+    with use(root):
+        try:
+            yield root
+        except BaseException as e:
+            if root is not None:
+                root.error = repr(e)
+            raise
+        finally:
+            finish(root)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    ✅ with tracing.span("渲染"): ... → 在当前追踪下记录一段耗时
+    不在追踪里（如定时任务、启动阶段）时什么都不做，返回 None
+    """
+    parent = _current.get()
+    if parent is None or parent.trace.finished or len(parent.trace.spans) >= MAX_SPANS:
+        yield None
+        return
+    child = Span(parent.trace, name, parent, attrs)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current.reset(token)
+
+
+def traced(name: Optional[str] = None):
+    """
+    协程函数装饰器：每次调用记录一个 span，默认以函数名命名
+    """
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(label):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def annotate(**attrs):
+    """给当前 span 补充属性（不在追踪里时忽略）"""
+    current = _current.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+# ========== 导出/查看 ==========
+def _export(item: Trace):
+    """加入待写队列，由定时的 _flush 批量写盘，事件循环上不做文件操作"""
+    global _flush_handle
+    _pending_lines.append(json.dumps(item.to_dict(), ensure_ascii=False, default=str) + "\n")
+    if _flush_handle is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            _flush()
+            return
+        _flush_handle = loop.call_later(EXPORT_FLUSH_INTERVAL, _flush)
+
+
+def _flush():
+    global _flush_handle
+    _flush_handle = None
+    lines = _pending_lines[:]
+    _pending_lines.clear()
+    if not lines:
+        return
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _write, lines)
+    except RuntimeError:
+        _write(lines)
+
+
+def _write(lines: List[str]):
+    try:
+        os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+        if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) > TRACE_FILE_MAX_BYTES:
+            os.replace(TRACE_FILE, f"{TRACE_FILE}.1")
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+    except OSError as e:
+        logger.warning(f"写入追踪文件失败：{e}")
+
+
+def slowest(top: int = 5, name: Optional[str] = None) -> List[Trace]:
+    """最近的追踪里总耗时最长的几条，name 指定时只看包含该 span 名称的追踪"""
+    traces = [t for t in RECENT if name is None or any(name in s.name for s in t.spans)]
+    return sorted(traces, key=lambda t: t.root.duration_ms, reverse=True)[:top]
+
+
+def format_trace(item: Trace) -> str:
+    """按调用层级输出：+开始偏移 耗时 名称 属性（并发的子 span 各自挂在父 span 下）"""
+    base = item.root.start
+    lines = [f"#{item.id} {time.strftime('%H:%M:%S', time.localtime(item.started_at))} "
+             f"共 {item.root.duration_ms:.0f}ms"]
+    children = {}
+    for s in item.spans[1:]:
+        children.setdefault(s.parent, []).append(s)
+    stack = [item.root]
+    while stack:
+        s = stack.pop()
+        stack.extend(reversed(children.get(s.index, [])))
+        cost = "未结束" if s.end is None else f"{s.duration_ms:.0f}ms"
+        attrs = " ".join(f"{k}={v}" for k, v in s.attrs.items())
+        error = f" ❌{s.error[:80]}" if s.error else ""
+        lines.append(f"{'  ' * s.depth}+{(s.start - base) * 1000:.0f}ms {cost} {s.name} {attrs}{error}".rstrip())
+    return "\n".join(lines)
+
+
+def report(top: int = 5, name: Optional[str] = None) -> str:
+    traces = slowest(top, name)
+    if not traces:
+        return "最近没有追踪记录"
+    return f"最近 {len(RECENT)} 条追踪中最慢的 {len(traces)} 条：\n\n" + "\n\n".join(format_trace(t) for t in traces)
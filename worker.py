@@ -0,0 +1,82 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+from loguru import logger
+
+# ========== 全局变量 ==========
+MAX_WORKERS = min(4, os.cpu_count() or 1)  # 进程数
+MAX_PENDING = 32  # 排队上限（含正在执行的任务），超过直接拒绝
+DEFAULT_TIMEOUT = 30  # 默认超时（秒）
+
+
+class PoolFull(RuntimeError):
+    """进程池排队已满"""
+
+
+class CpuPool:
+    """
+    托管进程池：把 CPU 密集的同步函数丢到子进程执行，事件循环只负责等待结果
+    - 排队数量有上限，满了直接抛 PoolFull，不让任务无限堆积
+    - 超时或被取消时，还没开始的任务直接取消；已经在跑的任务会重建进程池强制终止
+    注意：func 和参数都需要能被 pickle（模块顶层函数、内置函数等）
+    """
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # 第一次使用时才创建，避免启动时拉起子进程
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _reset(self) -> None:
+        """终止所有子进程并丢弃进程池，下次使用时重建"""
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # ProcessPoolExecutor 没有公开的终止接口，只能直接结束子进程
+        for proc in list((executor._processes or {}).values()):
+            proc.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("进程池任务超时/取消，已重建进程池")
+
+    async def run(self, func: Callable, *args, timeout: Optional[float] = DEFAULT_TIMEOUT, **kwargs):
+        """
+        在子进程中执行 func(*args, **kwargs)
+        :param timeout: 超时秒数，None 为不限
+        :return: func 的返回值
+        """
+        if self.pending >= self.max_pending:
+            raise PoolFull(f"进程池繁忙（排队 {self.pending}）")
+        self.pending += 1
+        job = self._get_executor().submit(functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # 还在排队的任务能直接取消；已在子进程中运行的只能重建进程池
+            # （同一进程池里其他正在运行的任务会收到 BrokenProcessPool）
+            if not job.cancel() and not job.done():
+                self._reset()
+            raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+cpu_pool = CpuPool()
+
+
+async def run_cpu(func: Callable, *args, timeout: Optional[float] = DEFAULT_TIMEOUT, **kwargs):
+    """
+    快捷接口：cpu_pool.run 的别名，处理器中可通过 ctx["run_cpu"] 调用
+    """
+    return await cpu_pool.run(func, *args, timeout=timeout, **kwargs)